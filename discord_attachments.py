@@ -0,0 +1,129 @@
+import os
+import re
+import asyncio
+import hashlib
+import aiohttp
+from pathlib import Path
+from typing import Optional, List
+from discord_models import Message, Attachment
+
+DOWNLOAD_WORKERS = 8  # одновременных загрузок
+DOWNLOAD_QUEUE_SIZE = 10000  # вложений в очереди до того, как выгрузка сообщений начнёт ждать
+CHUNK_SIZE = 1 << 16
+
+class AttachmentDownloader:
+    """Фоновая загрузка вложений в output_dir/attachments.
+
+    Каждое вложение получает стабильный путь files/<id>-<имя>, который сразу
+    пишется в экспорт как local_path, а сам файл загружается пулом воркеров.
+    Если загрузка не удалась, HTML всё равно ссылается и на исходный URL.
+    Содержимое хранится один раз в blobs/<sha256>, а files/ - жёсткие ссылки
+    на него. Уже загруженные вложения пропускаются, недокачанные файлы из
+    .partial/ докачиваются через Range.
+    """
+
+    def __init__(self, output_dir: Path, workers: int = DOWNLOAD_WORKERS, quiet: bool = False):
+        self.root = output_dir / 'attachments'
+        self.files_dir = self.root / 'files'
+        self.blobs_dir = self.root / 'blobs'
+        self.partial_dir = self.root / '.partial'
+        for directory in (self.files_dir, self.blobs_dir, self.partial_dir):
+            directory.mkdir(parents=True, exist_ok=True)
+        self.workers = workers
+        self.quiet = quiet  # без итоговой строки, ошибки загрузки выводятся всегда
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=DOWNLOAD_QUEUE_SIZE)
+        self.tasks: List[asyncio.Task] = []
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.queued = set()
+        self.downloaded = 0
+        self.deduplicated = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def local_path(self, attachment: Attachment) -> Path:
+        filename = re.sub(r'[^\w.\-]', '_', attachment.filename or 'file')[-100:]
+        return self.files_dir / f"{attachment.id}-{filename}"
+
+    async def add_page(self, page: List[Message]):
+        """Проставляет local_path вложениям страницы и ставит их в очередь загрузки"""
+        for message in page:
+            for attachment in message.attachments:
+                path = self.local_path(attachment)
+                attachment.local_path = path.relative_to(self.root.parent).as_posix()
+                if path.exists():
+                    self.skipped += 1
+                    continue
+                if attachment.id in self.queued:
+                    continue
+                self.queued.add(attachment.id)
+                self._start()
+                await self.queue.put((attachment.url, path))
+
+    def _start(self):
+        if self.tasks:
+            return
+        # Отдельная сессия без заголовков API: токен не должен уходить на CDN
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.workers))
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def close(self):
+        """Дожидается загрузки всей очереди и закрывает сессию"""
+        if self.tasks:
+            await self.queue.join()
+            for task in self.tasks:
+                task.cancel()
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+            self.tasks = []
+            await self.session.close()
+            self.session = None
+        if not self.quiet and (self.downloaded or self.skipped or self.failed):
+            print(f"Вложения: загружено {self.downloaded}, из них дублей {self.deduplicated}, "
+                  f"уже было {self.skipped}, ошибок {self.failed}")
+
+    async def _worker(self):
+        while True:
+            url, path = await self.queue.get()
+            try:
+                await self._download(url, path)
+            except Exception as e:
+                self.failed += 1
+                print(f"Ошибка загрузки вложения {url}: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def _download(self, url: str, path: Path):
+        partial = self.partial_dir / path.name
+        offset = partial.stat().st_size if partial.exists() else 0
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+        async with self.session.get(url, headers=headers) as response:
+            if response.status == 416:
+                offset = 0  # частичный файл уже полный или устарел - проверим хэш ниже
+            elif response.status not in (200, 206):
+                raise Exception(f"HTTP {response.status}")
+            else:
+                if response.status == 200:
+                    offset = 0  # сервер не поддержал Range - качаем заново
+                with open(partial, 'ab' if offset else 'wb') as f:
+                    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                        f.write(chunk)
+
+        digest = hashlib.sha256()
+        with open(partial, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+        sha256 = digest.hexdigest()
+        blob = self.blobs_dir / sha256[:2] / (sha256 + path.suffix.lower())
+        if blob.exists():
+            partial.unlink()
+            self.deduplicated += 1
+        else:
+            blob.parent.mkdir(exist_ok=True)
+            os.replace(partial, blob)
+        try:
+            os.link(blob, path)
+        except OSError:
+            # Файловая система без жёстких ссылок
+            with open(blob, 'rb') as src, open(path, 'wb') as dst:
+                for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+                    dst.write(chunk)
+        self.downloaded += 1
@@ -0,0 +1,340 @@
+"""Бенчмарк DiscordExporter на локальном имитаторе Discord API.
+
+Запуск:
+    python discord_benchmark.py --messages 20000 --channels 8
+    python discord_benchmark.py --output results.json --compare baseline.json
+
+Имитатор (MockDiscordAPI) отдаёт синтетические каналы заданного размера,
+заголовки X-RateLimit-* с ответами 429 при превышении и искусственную
+задержку. Каждый сценарий запускается в отдельном процессе, чтобы пиковый
+RSS относился только к нему.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import importlib.util
+from pathlib import Path
+from typing import Optional, List, Dict, Any
+
+from aiohttp import web
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+DISCORD_EPOCH = 1420070400000
+BASE_TIME = 1577836800000 - DISCORD_EPOCH  # 2020-01-01, мс от эпохи Discord
+MESSAGE_STEP = 1000  # мс между соседними синтетическими сообщениями
+GUILD_ID = 100
+FORMATS = ('json', 'jsonl', 'html', 'txt', 'csv', 'parquet')
+RESULT_PREFIX = 'BENCHMARK_RESULT '
+
+class MockDiscordAPI:
+    """Минимальная замена Discord API для /users/@me, /users/@me/guilds,
+    /guilds/{id}/channels, /channels/{id} и /channels/{id}/messages.
+
+    Сообщения не хранятся, а вычисляются по номеру, поэтому канал может быть
+    сколь угодно большим. Лимит - rate_limit запросов за rate_window секунд
+    на канал, как у бакета сообщений Discord.
+    """
+
+    def __init__(self, channel_sizes: Dict[int, int], latency: float = 0.0,
+                 rate_limit: int = 50, rate_window: float = 1.0, authors: int = 200):
+        self.channel_sizes = channel_sizes
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.authors = [
+            {'id': str(10 ** 17 + i), 'username': f'user{i}', 'global_name': f'User {i}',
+             'discriminator': '0', 'avatar': f'{i:032x}', 'public_flags': 0, 'banner': None}
+            for i in range(authors)
+        ]
+        self.windows: Dict[str, List[float]] = {}  # бакет -> [начало окна, использовано]
+        self.requests = 0
+        self.rate_limited = 0
+        self.runner: Optional[web.AppRunner] = None
+
+    def message(self, channel_id: int, index: int) -> Dict[str, Any]:
+        message_id = (BASE_TIME + index * MESSAGE_STEP) << 22
+        rnd = random.Random(message_id)
+        author = self.authors[rnd.randrange(len(self.authors))]
+        timestamp = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime((BASE_TIME + index * MESSAGE_STEP + DISCORD_EPOCH) / 1000))
+        return {
+            'id': str(message_id),
+            'type': 0,
+            'channel_id': str(channel_id),
+            'author': author,
+            'content': ' '.join(rnd.choice(('hello', 'world', 'discord', 'export', 'test', 'message', 'lol', 'ok'))
+                                for _ in range(rnd.randint(1, 30))),
+            'timestamp': timestamp + '.000000+00:00',
+            'edited_timestamp': None,
+            'tts': False,
+            'mention_everyone': False,
+            'mentions': [],
+            'mention_roles': [],
+            'attachments': [{
+                'id': str(message_id + 1), 'filename': 'image.png', 'size': 1024,
+                'url': f'https://cdn.discordapp.com/attachments/{channel_id}/{message_id}/image.png',
+                'proxy_url': f'https://media.discordapp.net/attachments/{channel_id}/{message_id}/image.png',
+                'content_type': 'image/png', 'width': 64, 'height': 64,
+            }] if index % 20 == 0 else [],
+            'embeds': [],
+            'reactions': [{'emoji': {'id': None, 'name': '👍'}, 'count': rnd.randint(1, 5), 'me': False}] if index % 7 == 0 else [],
+            'pinned': False,
+            'flags': 0,
+            'components': [],
+        }
+
+    def _index_before(self, before: int) -> int:
+        """Номер самого нового сообщения с id < before"""
+        delta = before - (BASE_TIME << 22)
+        return -1 if delta <= 0 else (delta - 1) // (MESSAGE_STEP << 22)
+
+    def _rate_limit_headers(self, bucket: str) -> Optional[Dict[str, str]]:
+        now = time.monotonic()
+        window = self.windows.setdefault(bucket, [now, 0])
+        if now - window[0] >= self.rate_window:
+            window[0], window[1] = now, 0
+        reset_after = self.rate_window - (now - window[0])
+        if window[1] >= self.rate_limit:
+            return None
+        window[1] += 1
+        return {
+            'X-RateLimit-Limit': str(self.rate_limit),
+            'X-RateLimit-Remaining': str(self.rate_limit - window[1]),
+            'X-RateLimit-Reset-After': f'{reset_after:.3f}',
+            'X-RateLimit-Bucket': 'messages',
+        }
+
+    async def _respond(self, bucket: str, payload: Any) -> web.Response:
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+        headers = self._rate_limit_headers(bucket)
+        if headers is None:
+            self.rate_limited += 1
+            window = self.windows[bucket]
+            retry_after = max(self.rate_window - (time.monotonic() - window[0]), 0.001)
+            return web.json_response({'message': 'You are being rate limited.', 'retry_after': retry_after, 'global': False},
+                                     status=429, headers={'Retry-After': f'{retry_after:.3f}', 'X-RateLimit-Scope': 'user'})
+        return web.json_response(payload, headers=headers)
+
+    async def user(self, request: web.Request) -> web.Response:
+        return await self._respond('user', {'id': '1', 'username': 'benchmark', 'discriminator': '0'})
+
+    async def guilds(self, request: web.Request) -> web.Response:
+        return await self._respond('guilds', [{'id': str(GUILD_ID), 'name': 'Benchmark guild'}])
+
+    def _channel(self, channel_id: int) -> Dict[str, Any]:
+        size = self.channel_sizes.get(channel_id, 0)
+        return {
+            'id': str(channel_id), 'type': 0, 'name': f'channel-{channel_id}', 'guild_id': str(GUILD_ID),
+            'parent_id': None, 'last_message_id': self.message(channel_id, size - 1)['id'] if size else None,
+        }
+
+    async def guild_channels(self, request: web.Request) -> web.Response:
+        return await self._respond('guild_channels', [self._channel(channel_id) for channel_id in self.channel_sizes])
+
+    async def channel(self, request: web.Request) -> web.Response:
+        channel_id = int(request.match_info['channel_id'])
+        if channel_id not in self.channel_sizes:
+            return web.json_response({'message': 'Unknown Channel', 'code': 10003}, status=404)
+        return await self._respond(f'channel:{channel_id}', self._channel(channel_id))
+
+    async def messages(self, request: web.Request) -> web.Response:
+        channel_id = int(request.match_info['channel_id'])
+        size = self.channel_sizes.get(channel_id)
+        if size is None:
+            return web.json_response({'message': 'Unknown Channel', 'code': 10003}, status=404)
+        limit = min(int(request.query.get('limit', 50)), 100)
+        if 'before' in request.query:
+            newest = min(self._index_before(int(request.query['before'])), size - 1)
+            indexes = range(newest, max(newest - limit, -1), -1)
+        elif 'after' in request.query:
+            oldest = max(self._index_before(int(request.query['after']) + 1) + 1, 0)
+            indexes = range(min(oldest + limit, size) - 1, oldest - 1, -1)
+        else:
+            indexes = range(size - 1, max(size - 1 - limit, -1), -1)
+        return await self._respond(f'messages:{channel_id}', [self.message(channel_id, i) for i in indexes])
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/api/v9/users/@me', self.user)
+        app.router.add_get('/api/v9/users/@me/guilds', self.guilds)
+        app.router.add_get('/api/v9/guilds/{guild_id}/channels', self.guild_channels)
+        app.router.add_get('/api/v9/channels/{channel_id}', self.channel)
+        app.router.add_get('/api/v9/channels/{channel_id}/messages', self.messages)
+        return app
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """Запуск сервера; возвращает базовый URL API"""
+        self.runner = web.AppRunner(self.app(), access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        return f'http://{host}:{port}/api/v9'
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+def peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS - байты
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+async def run_scenario(config: Dict[str, Any]) -> Dict[str, Any]:
+    """Один сценарий в текущем процессе: экспорт каналов из config['channels']"""
+    os.environ.setdefault('USER_TOKEN', 'benchmark')
+    from discord_exporter import DiscordExporter
+
+    output_dir = Path(config['output_dir'])
+    channel_ids = config['channels']
+    started = time.perf_counter()
+    async with DiscordExporter(output_format=config['format'], output_dir=str(output_dir),
+                               api_base=config['api_base'], incremental=False, quiet=True,
+                               max_concurrency=config.get('concurrency', 4)) as exporter:
+        if len(channel_ids) == 1:
+            counts = {channel_ids[0]: await exporter.export_channel(channel_ids[0])}
+        else:
+            counts = await exporter.export_channels(channel_ids)
+        connections = exporter.connections_opened
+        summary = exporter.metrics.summary()
+    elapsed = time.perf_counter() - started
+    messages = sum(count or 0 for count in counts.values())
+    bytes_written = sum(path.stat().st_size for path in output_dir.rglob('*') if path.is_file())
+    return {
+        'messages': messages,
+        'seconds': round(elapsed, 3),
+        'messages_per_sec': round(messages / elapsed, 1) if elapsed else None,
+        'peak_rss_mb': peak_rss_mb(),
+        'bytes_written': bytes_written,
+        'connections': connections,
+        'rate_limit_wait_s': summary['rate_limit']['wait_seconds'],
+        'write_s': summary['formats'].get(config['format'], {}).get('seconds'),
+    }
+
+async def run_in_subprocess(config: Dict[str, Any]) -> Dict[str, Any]:
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.abspath(__file__), '--scenario', json.dumps(config),
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+    )
+    stdout, stderr = await process.communicate()
+    for line in stdout.decode('utf-8', 'replace').splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    raise RuntimeError(f"Scenario failed: {stderr.decode('utf-8', 'replace')[-2000:]}")
+
+async def run_benchmarks(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    single_id = 1000
+    multi_ids = [2000 + i for i in range(args.channels)]
+    sizes = {single_id: args.messages}
+    sizes.update({channel_id: args.messages // args.channels for channel_id in multi_ids})
+    formats = list(args.formats)
+    if 'parquet' in formats and importlib.util.find_spec('pyarrow') is None:
+        print("Parquet пропущен: pyarrow не установлен")
+        formats.remove('parquet')
+    api = MockDiscordAPI(sizes, latency=args.latency, rate_limit=args.rate_limit, rate_window=args.rate_window)
+    api_base = await api.start()
+
+    scenarios = []
+    for output_format in formats:
+        scenarios.append(('single', output_format, [single_id]))
+    if args.channels > 1:
+        for output_format in formats:
+            scenarios.append((f'multi x{args.channels}', output_format, multi_ids))
+
+    results = []
+    try:
+        for name, output_format, channel_ids in scenarios:
+            with tempfile.TemporaryDirectory(prefix='discord-bench-') as output_dir:
+                requests_before, limited_before = api.requests, api.rate_limited
+                result = await run_in_subprocess({
+                    'format': output_format, 'channels': channel_ids, 'api_base': api_base,
+                    'output_dir': output_dir, 'concurrency': args.concurrency,
+                })
+                result.update({
+                    'scenario': name, 'format': output_format,
+                    'requests': api.requests - requests_before,
+                    'rate_limited': api.rate_limited - limited_before,
+                })
+                results.append(result)
+                print_result(result)
+    finally:
+        await api.stop()
+    return results
+
+COLUMNS = ('scenario', 'format', 'messages', 'seconds', 'messages_per_sec', 'peak_rss_mb', 'bytes_written',
+           'requests', 'rate_limited', 'rate_limit_wait_s', 'write_s')
+
+def print_result(result: Dict[str, Any]):
+    if not getattr(print_result, 'header_printed', False):
+        print(' | '.join(f'{column:>16}' for column in COLUMNS))
+        print_result.header_printed = True
+    print(' | '.join(f'{str(result.get(column)):>16}' for column in COLUMNS))
+
+def compare(results: List[Dict[str, Any]], baseline_path: str, tolerance: float) -> bool:
+    """Сравнение с сохранёнными результатами; True, если регрессий нет"""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {(r['scenario'], r['format']): r for r in json.load(f)['results']}
+    ok = True
+    for result in results:
+        old = baseline.get((result['scenario'], result['format']))
+        if not old:
+            continue
+        checks = (
+            ('messages_per_sec', old['messages_per_sec'], result['messages_per_sec'], -1),
+            ('peak_rss_mb', old['peak_rss_mb'], result['peak_rss_mb'], 1),
+            ('bytes_written', old['bytes_written'], result['bytes_written'], 1),
+        )
+        for metric, before, after, direction in checks:
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            if change * direction > tolerance:
+                ok = False
+                print(f"РЕГРЕССИЯ {result['scenario']}/{result['format']} {metric}: {before} -> {after} ({change:+.1%})")
+    return ok
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Бенчмарк DiscordExporter на локальном имитаторе API")
+    parser.add_argument('--messages', type=int, default=20000, help="сообщений в канале (для нескольких каналов - всего)")
+    parser.add_argument('--channels', type=int, default=8, help="каналов в многоканальном сценарии (1 - не запускать)")
+    parser.add_argument('--formats', type=lambda value: value.split(','), default=list(FORMATS))
+    parser.add_argument('--concurrency', type=int, default=4, help="параллельных каналов в многоканальном сценарии")
+    parser.add_argument('--latency', type=float, default=0.02, help="средняя задержка ответа, с")
+    parser.add_argument('--rate-limit', type=int, default=50, help="запросов в окне на бакет")
+    parser.add_argument('--rate-window', type=float, default=1.0, help="длина окна лимита, с")
+    parser.add_argument('--output', help="сохранить результаты в JSON")
+    parser.add_argument('--compare', help="сравнить с результатами из JSON и вернуть код 1 при регрессии")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="допустимое ухудшение при сравнении")
+    parser.add_argument('--scenario', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    if args.scenario:
+        result = asyncio.run(run_scenario(json.loads(args.scenario)))
+        print(RESULT_PREFIX + json.dumps(result))
+        return 0
+
+    results = asyncio.run(run_benchmarks(args))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'config': {k: v for k, v in vars(args).items() if k not in ('output', 'compare', 'scenario')},
+                       'results': results}, f, ensure_ascii=False, indent=2)
+    if args.compare and not compare(results, args.compare, args.tolerance):
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
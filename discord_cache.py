@@ -0,0 +1,87 @@
+import os
+import json
+import time
+from pathlib import Path
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Union
+
+# Время жизни записей по виду, секунд
+DEFAULT_TTLS = {
+    'user': 24 * 3600,  # /users/@me
+    'guilds': 3600,  # /users/@me/guilds
+    'channel': 3600,  # /channels/{id}
+    'guild_channels': 600,  # /guilds/{id}/channels
+    'guild_roles': 3600,  # /guilds/{id}/roles
+    'dm': 30 * 24 * 3600,  # канал личных сообщений с пользователем, его ID не меняется
+}
+METADATA_CACHE_SIZE = 2000  # записей; самые давно использованные вытесняются
+
+class MetadataCache:
+    """Кэш метаданных API на диске: пользователь, серверы, каналы и роли.
+
+    Ключ записи - '<вид>' или '<вид>:<id>', время жизни задаётся по виду.
+    Порядок записей - порядок использования, при переполнении вытесняются
+    самые давние. Файл перезаписывается атомарно в save(), если кэш менялся.
+    refresh=True - записи прошлых запусков считаются устаревшими, а новые
+    ответы сохраняются и используются дальше. account - отпечаток токена:
+    кэш другого аккаунта (его пользователь, серверы, личные чаты) отбрасывается.
+    """
+
+    def __init__(self, path: Union[str, Path], ttls: Optional[Dict[str, float]] = None,
+                 max_entries: int = METADATA_CACHE_SIZE, refresh: bool = False,
+                 account: Optional[str] = None):
+        self.path = Path(path)
+        self.account = account
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.max_entries = max_entries
+        self.refresh = refresh
+        self.started = time.time()
+        self.entries: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+        if self.path.exists():
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if account is None:
+                    self.account = data.get('account')
+                if data.get('account') == self.account:
+                    self.entries.update(data['entries'])
+                else:
+                    self.dirty = True  # файл перезапишется записями текущего аккаунта
+            except (ValueError, KeyError) as e:
+                print(f"Кэш метаданных {self.path} повреждён и будет пересоздан: {e}")
+
+    def _ttl(self, key: str) -> float:
+        return self.ttls.get(key.split(':', 1)[0], 0)
+
+    def get(self, key: str) -> Optional[Any]:
+        """Значение записи, если она есть и не устарела; иначе None"""
+        entry = self.entries.get(key)
+        if (entry is None or (self.refresh and entry['stored'] < self.started)
+                or time.time() - entry['stored'] >= self._ttl(key)):
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.dirty = True
+        self.hits += 1
+        return entry['value']
+
+    def put(self, key: str, value: Any, stored: Optional[float] = None):
+        """Запись значения; stored - когда оно получено (по умолчанию сейчас)"""
+        self.entries[key] = {'stored': time.time() if stored is None else stored, 'value': value}
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'account': self.account, 'entries': self.entries}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
@@ -1,28 +1,333 @@
 import os
 import json
+import re
+import time
 import asyncio
-import aiohttp
-import csv
-from datetime import datetime
-from dotenv import load_dotenv
-from jinja2 import Template
-from typing import Optional, List, Dict, Any, Union
+import hashlib
+import tempfile
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Optional, List, Dict, Any, Union, AsyncIterator, Iterable, Tuple, Callable, TYPE_CHECKING
 from pathlib import Path
+from discord_models import Message, AuthorCache, LookupTables
+from discord_cache import MetadataCache
+from discord_metrics import ExportMetrics, MetricsHook
+from discord_pipeline import ExportPipeline, PipelineItem
+from discord_render import RENDERERS, html_template, json_dumps
+from discord_output import ShardedOutput, compressed_path, result_path, check_compression, COMPRESSION_EXTENSIONS
 
-# Загрузка переменных окружения
-load_dotenv()
+# aiohttp, загрузчик вложений, pyarrow, локальная база и индекс поиска (sqlite3)
+# импортируются при первом использовании: импорт модуля не должен ни стоить
+# сотен миллисекунд, ни требовать токена
+if TYPE_CHECKING:
+    import aiohttp
+    from discord_store import MessageStore
+    from discord_search import SearchIndex
 
-# Используем USER_TOKEN вместо DISCORD_TOKEN
-token = os.getenv('USER_TOKEN')
-if not token:
-    raise ValueError("User token not found. Please set USER_TOKEN in .env file")
+API_BASE = 'https://discord.com/api/v9'
+
+# Параметры пула соединений общей сессии
+CONNECTION_LIMIT = 20  # максимум одновременных соединений
+CONNECTION_LIMIT_PER_HOST = 10
+DNS_CACHE_TTL = 300  # секунд
+KEEPALIVE_TIMEOUT = 60  # секунд простоя до закрытия keep-alive соединения
+
+MAX_RETRIES = 5  # повторов запроса после ответа 429
+
+DISCORD_EPOCH = 1420070400000  # начало отсчёта snowflake, мс
+TEXT_CHANNEL_TYPES = (0, 5)  # текстовые каналы и каналы объявлений
+DM_CHANNEL_TYPES = (1, 3)  # личные и групповые чаты
+MAX_CONCURRENT_CHANNELS = 4  # каналов, выгружаемых одновременно
+RENDER_EXECUTORS = ('thread', 'process')
+FAN_OUT_QUEUE_SIZE = 2  # страниц в очереди каждого писателя при выгрузке в несколько форматов
+
+SUPPORTED_FORMATS = ('json', 'jsonl', 'html', 'txt', 'csv', 'parquet')
+
+def snowflake_time_ms(snowflake: Union[int, str]) -> int:
+    """Время создания объекта Discord по его snowflake ID, мс с эпохи Unix"""
+    return (int(snowflake) >> 22) + DISCORD_EPOCH
+
+def datetime_to_snowflake(dt: datetime) -> int:
+    """Минимальный snowflake для момента времени - граница для before/after"""
+    return max(int(dt.timestamp() * 1000) - DISCORD_EPOCH, 0) << 22
+
+def parse_date_snowflake(value: str, end_of_day: bool = False) -> Optional[int]:
+    """Дата YYYY-MM-DD (UTC) в исключающую границу snowflake.
+
+    Без end_of_day - after для сообщений с начала дня: на единицу меньше
+    минимального snowflake полуночи, чтобы сообщение ровно в полночь вошло.
+    end_of_day - before для сообщений до конца дня включительно.
+    """
+    if not value:
+        return None
+    dt = datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    if end_of_day:
+        return datetime_to_snowflake(dt + timedelta(days=1))
+    return max(datetime_to_snowflake(dt) - 1, 0)
+
+class SlicePages:
+    """Страницы одного временного среза, буферизованные во временном файле.
+
+    Срезы выгружаются параллельно, а отдаются по порядку; пока потребитель
+    читает текущий срез, остальные копятся на диске, а не в памяти.
+    """
+
+    def __init__(self):
+        self.file = tempfile.TemporaryFile('w+', encoding='utf-8')
+        self.read_pos = 0
+        self.written = 0
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.changed = asyncio.Event()
+
+    def put(self, page: List[Dict]):
+        self.file.seek(0, os.SEEK_END)
+        self.file.write(json_dumps(page) + '\n')
+        self.written += 1
+        self.changed.set()
+
+    def finish(self):
+        self.done = True
+        self.changed.set()
+
+    async def pages(self) -> AsyncIterator[List[Dict]]:
+        read = 0
+        while True:
+            if read < self.written:
+                self.file.flush()
+                self.file.seek(self.read_pos)
+                line = self.file.readline()
+                self.read_pos = self.file.tell()
+                read += 1
+                yield json.loads(line)
+            elif self.done:
+                if self.error is not None:
+                    raise self.error
+                break
+            else:
+                self.changed.clear()
+                await self.changed.wait()
+        self.file.close()
+
+class DiscordAPIError(Exception):
+    def __init__(self, message: str, status: int):
+        super().__init__(message)
+        self.status = status
+
+class RateLimitBucket:
+    __slots__ = ('limit', 'remaining', 'reset_at', 'lock')
+
+    def __init__(self):
+        self.limit: Optional[int] = None
+        self.remaining: Optional[int] = None  # None - лимит ещё неизвестен
+        self.reset_at = 0.0
+        self.lock = asyncio.Lock()
+
+class RateLimiter:
+    """Планировщик запросов по заголовкам X-RateLimit-* Discord.
+
+    Запросы уходят без пауз, пока в бакете остаются запросы, и ждут ровно до
+    X-RateLimit-Reset-After, когда бакет исчерпан. Один экземпляр делится
+    всеми запросами экспортера, поэтому параллельные выгрузки расходуют
+    общий бюджет.
+    """
+
+    _MAJOR_PARAM = re.compile(r'^/(channels|guilds|webhooks)/(\d+)')
+
+    def __init__(self):
+        self.route_buckets: Dict[str, str] = {}  # маршрут -> ключ бакета
+        self.buckets: Dict[str, RateLimitBucket] = {}
+        self.global_reset_at = 0.0
+
+    def _bucket_key(self, route: str) -> str:
+        return self.route_buckets.get(route, route)
+
+    def _get_bucket(self, key: str) -> RateLimitBucket:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = RateLimitBucket()
+        return bucket
+
+    async def acquire(self, route: str) -> float:
+        """Ожидание разрешения на запрос. Возвращает время ожидания в секундах"""
+        started = time.monotonic()
+        delay = self.global_reset_at - started
+        if delay > 0:
+            await asyncio.sleep(delay)
+        bucket = self._get_bucket(self._bucket_key(route))
+        async with bucket.lock:
+            delay = bucket.reset_at - time.monotonic()
+            if bucket.remaining is not None and bucket.remaining <= 0 and delay > 0:
+                await asyncio.sleep(delay)
+            if time.monotonic() >= bucket.reset_at:
+                # Окно сброшено: восстанавливаем квоту до известного лимита
+                bucket.remaining = bucket.limit
+            if bucket.remaining is not None:
+                bucket.remaining -= 1
+        return time.monotonic() - started
+
+    def update(self, route: str, headers) -> None:
+        """Обновление состояния бакета по заголовкам ответа"""
+        bucket_hash = headers.get('X-RateLimit-Bucket')
+        if bucket_hash:
+            match = self._MAJOR_PARAM.match(route.split(' ', 1)[-1])
+            key = f"{bucket_hash}:{match.group(2) if match else ''}"
+            if self.route_buckets.get(route) != key:
+                self.route_buckets[route] = key
+        bucket = self._get_bucket(self._bucket_key(route))
+        remaining = headers.get('X-RateLimit-Remaining')
+        reset_after = headers.get('X-RateLimit-Reset-After')
+        if remaining is not None and reset_after is not None:
+            now = time.monotonic()
+            remaining = int(remaining)
+            if bucket.remaining is not None and now < bucket.reset_at:
+                # Ответы в пределах окна могут прийти не по порядку - берём минимум
+                remaining = min(remaining, bucket.remaining)
+            bucket.limit = int(headers.get('X-RateLimit-Limit', bucket.limit or 1))
+            bucket.remaining = remaining
+            bucket.reset_at = now + float(reset_after)
+
+    def on_rate_limited(self, route: str, retry_after: float, is_global: bool) -> None:
+        """Учёт ответа 429: блокируем бакет (или все запросы) на retry_after"""
+        reset_at = time.monotonic() + retry_after
+        if is_global:
+            self.global_reset_at = max(self.global_reset_at, reset_at)
+        else:
+            bucket = self._get_bucket(self._bucket_key(route))
+            bucket.remaining = 0
+            bucket.reset_at = max(bucket.reset_at, reset_at)
+
+class ExportManifest:
+    """Контрольные точки выгрузки каналов (manifest.json в output_dir).
+
+    Запись ведётся на канал и подпись вывода (форматы, сжатие, normalized,
+    raw): выгрузка того же канала с другими настройками начинается заново.
+    Для каждой записи хранятся newest_id/oldest_id выгруженных сообщений,
+    список записанных шардов и gaps - диапазоны [upper, lower), которые ещё
+    нужно выгрузить (upper=None - самые новые сообщения, lower=None - начало
+    истории). Файл перезаписывается атомарно после каждой записанной страницы.
+    """
+
+    FILENAME = 'manifest.json'
+
+    def __init__(self, output_dir: Path):
+        self.output_dir = output_dir
+        self.path = output_dir / self.FILENAME
+        self.data: Dict[str, Any] = {'channels': {}}
+        if self.path.exists():
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.data = json.load(f)
+
+    def channel(self, channel_id: int, signature: str) -> Optional[Dict[str, Any]]:
+        """Запись канала; диапазоны шардов, чьи файлы удалены, снова становятся gaps"""
+        entry = self.data['channels'].get(f'{channel_id}:{signature}')
+        if entry is not None:
+            self._restore_missing_shards(entry)
+        return entry
+
+    def start_channel(self, channel_id: int, signature: str) -> Dict[str, Any]:
+        """Запись канала с диапазонами, которые нужно выгрузить в этом запуске"""
+        entry = self.channel(channel_id, signature)
+        if entry is None:
+            entry = self.data['channels'][f'{channel_id}:{signature}'] = {
+                'newest_id': None,
+                'oldest_id': None,
+                'gaps': [[None, None]],
+                'shards': [],
+            }
+        if not any(gap[0] is None for gap in entry['gaps']):
+            # Новые сообщения после контрольной точки; канал, пустой в прошлый раз, - вся история
+            entry['gaps'].insert(0, [None, entry['newest_id']])
+        return entry
+
+    def _restore_missing_shards(self, entry: Dict[str, Any]):
+        missing = [shard for shard in entry['shards']
+                   if not all((self.output_dir / name).exists() for name in shard['files'])]
+        if not missing:
+            return
+        for shard in missing:
+            entry['shards'].remove(shard)
+            # Границы gaps исключающие: шард занимал [oldest_id, newest_id] включительно
+            entry['gaps'].append([str(int(shard['newest_id']) + 1), str(int(shard['oldest_id']) - 1)])
+        # Диапазоны выгружаются от новых к старым, чтобы новый шард остался упорядоченным
+        entry['gaps'].sort(key=lambda gap: float('inf') if gap[0] is None else int(gap[0]), reverse=True)
+        self.save()
+
+    def save(self):
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
 
 class DiscordExporter:
-    def __init__(self, output_format: str = 'json', output_dir: str = 'exports'):
-        self.token = token
-        self.output_format = output_format.lower()
+    def __init__(self, output_format: Union[str, Iterable[str]] = 'json', output_dir: str = 'exports',
+                 max_concurrency: int = MAX_CONCURRENT_CHANNELS, incremental: bool = True,
+                 store_path: Optional[str] = None, json_indent: Optional[int] = 2,
+                 html_page_size: Optional[int] = None, download_attachments: bool = False,
+                 api_base: str = API_BASE, quiet: bool = False,
+                 metrics_hooks: Optional[List[MetricsHook]] = None, metrics_path: Optional[str] = None,
+                 raw: bool = False, compression: Optional[str] = None,
+                 shard_bytes: Optional[int] = None, shard_messages: Optional[int] = None,
+                 search_index_path: Optional[str] = None, normalized: bool = False,
+                 render_executor: Optional[str] = None, render_workers: Optional[int] = None,
+                 metadata_cache_path: Optional[str] = None, metadata_ttls: Optional[Dict[str, float]] = None,
+                 refresh_metadata: bool = False, token: Optional[str] = None):
+        # Используем USER_TOKEN вместо DISCORD_TOKEN, если токен не передан явно
+        self.token = token or os.getenv('USER_TOKEN')
+        self.api_base = api_base.rstrip('/')
+        self.quiet = quiet  # без текстового прогресса, только ошибки
+        self.metrics = ExportMetrics(metrics_hooks)
+        self.metrics_path = metrics_path  # куда записать JSON-сводку при закрытии
+        self.raw = raw  # сохранять полный ответ API в JSON-форматах
+        self.normalized = normalized  # авторы, роли и каналы - в таблицы рядом с экспортом, в сообщениях только ID
+        # Рендер страниц в пуле потоков или процессов, чтобы не занимать цикл событий
+        if render_executor is not None and render_executor not in RENDER_EXECUTORS:
+            raise ValueError(f"Unsupported render executor: {render_executor}")
+        self.render_executor = render_executor
+        self.render_workers = render_workers
+        self.render_pool: Optional[Executor] = None
+        self.authors = AuthorCache()
+        self.max_concurrency = max_concurrency
+        # Один формат, несколько через запятую ('json,html') или список форматов
+        if isinstance(output_format, str):
+            output_format = output_format.split(',')
+        self.output_formats = tuple(dict.fromkeys(fmt.strip().lower() for fmt in output_format if fmt.strip()))
+        self.output_format = self.output_formats[0]
         self.output_dir = Path(output_dir)
-        self.output_dir.mkdir(exist_ok=True)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.incremental = incremental
+        self.json_indent = json_indent  # None - компактный JSON без отступов
+        self.html_page_size = html_page_size  # сообщений на HTML-страницу, None - один файл
+        check_compression(compression)
+        self.compression = compression  # None, 'gzip' или 'zstd'
+        # Нарезка файлов на части по несжатому объёму и/или числу сообщений
+        self.shard_bytes = shard_bytes
+        self.shard_messages = shard_messages
+        self.manifest = ExportManifest(self.output_dir)
+        # Контрольные точки относятся только к выгрузкам с такими же настройками вывода
+        self.output_signature = ':'.join(['+'.join(sorted(self.output_formats)), *filter(None, (
+            compression, 'normalized' if normalized else None, 'raw' if raw else None))])
+        # Пользователь, серверы, каналы и роли между запусками; refresh_metadata - запросить заново
+        # Кэш привязан к отпечатку токена: после смены аккаунта чужие записи не используются
+        account = hashlib.sha256(self.token.encode('utf-8')).hexdigest()[:16] if self.token else None
+        self.metadata = MetadataCache(metadata_cache_path or self.output_dir / 'metadata_cache.json',
+                                      metadata_ttls, refresh=refresh_metadata, account=account)
+        # Необязательное локальное хранилище: всё выгруженное попадает в SQLite
+        self.store: Optional['MessageStore'] = None
+        if store_path:
+            from discord_store import MessageStore
+            self.store = MessageStore(store_path)
+        # Необязательный полнотекстовый индекс, пополняется из потока выгрузки
+        self.search_index: Optional['SearchIndex'] = None
+        if search_index_path:
+            from discord_search import SearchIndex
+            self.search_index = SearchIndex(search_index_path)
+        # Необязательная загрузка вложений: ссылки в экспорте ведут на локальные копии
+        self.downloader = None
+        if download_attachments:
+            from discord_attachments import AttachmentDownloader
+            self.downloader = AttachmentDownloader(self.output_dir, quiet=quiet)
         self.exported_files = []
         self.headers = {
             'Authorization': self.token,  # Используем токен напрямую
@@ -34,238 +339,959 @@ class DiscordExporter:
             'Origin': 'https://discord.com',
             'Referer': 'https://discord.com/channels/@me'
         }
+        self.session: Optional['aiohttp.ClientSession'] = None
+        self.owns_session = True  # False - сессия взята у другого экспортера через share_session
+        self.connections_opened = 0  # сколько TCP/TLS соединений пришлось установить
+        self.rate_limiter = RateLimiter()
 
-    async def get_user_info(self):
-        async with aiohttp.ClientSession(headers=self.headers) as session:
-            async with session.get('https://discord.com/api/v9/users/@me') as response:
+    async def __aenter__(self):
+        # Сессия открывается первым запросом к API: без сети (export_from_store) токен не нужен
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def start(self) -> 'aiohttp.ClientSession':
+        """Создание общей сессии с пулом keep-alive соединений"""
+        if self.session is None or self.session.closed:
+            if not self.token:
+                raise ValueError("User token not found. Pass token= or set USER_TOKEN in .env file")
+            import aiohttp
+            connector = aiohttp.TCPConnector(
+                limit=CONNECTION_LIMIT,
+                limit_per_host=CONNECTION_LIMIT_PER_HOST,
+                ttl_dns_cache=DNS_CACHE_TTL,
+                keepalive_timeout=KEEPALIVE_TIMEOUT,
+            )
+            trace_config = aiohttp.TraceConfig()
+            trace_config.on_connection_create_end.append(self._on_connection_created)
+            self.session = aiohttp.ClientSession(headers=self.headers, connector=connector, trace_configs=[trace_config])
+        return self.session
+
+    async def share_session(self, other: 'DiscordExporter'):
+        """Сессия, лимиты запросов, кэш метаданных и метрики другого экспортера.
+
+        Экспортеры с разными настройками вывода в одном процессе делят
+        соединения и общий бюджет лимитов; закрывает сессию её владелец.
+        """
+        self.session = await other.start()
+        self.owns_session = False
+        self.rate_limiter = other.rate_limiter
+        self.metadata = other.metadata
+        self.metrics = other.metrics
+
+    async def close(self):
+        """Закрытие общей сессии и всех соединений пула"""
+        if self.downloader is not None:
+            await self.downloader.close()
+        if self.render_pool is not None:
+            self.render_pool.shutdown()
+            self.render_pool = None
+        if self.owns_session and self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+        if self.store is not None:
+            self.store.close()
+        if self.search_index is not None:
+            self.search_index.close()
+        self.metadata.save()
+        if self.metadata.hits:
+            self._log(f"Кэш метаданных: {self.metadata.hits} запросов пропущено, {self.metadata.misses} выполнено")
+        if self.metrics_path:
+            self.metrics.write_summary(self.metrics_path)
+            self._log(f"Сводка метрик: {self.metrics_path}")
+
+    def _log(self, message: str):
+        """Текстовый прогресс; в режиме quiet подавляется"""
+        if not self.quiet:
+            print(message)
+
+    async def _on_connection_created(self, session, trace_config_ctx, params):
+        self.connections_opened += 1
+
+    async def _request(self, path: str, error: str, method: str = 'GET', **kwargs) -> Any:
+        """Запрос к API через общий планировщик лимитов.
+
+        Ответы 429 повторяются прозрачно после retry_after; остальные
+        ошибки поднимаются как DiscordAPIError с префиксом error.
+        """
+        session = await self.start()
+        route = f'{method} {path}'
+        for attempt in range(MAX_RETRIES + 1):
+            self.metrics.record_rate_limit_wait(route, await self.rate_limiter.acquire(route))
+            started = time.perf_counter()
+            async with session.request(method, f'{self.api_base}{path}', **kwargs) as response:
+                self.rate_limiter.update(route, response.headers)
                 if response.status == 200:
-                    return await response.json()
-                else:
-                    raise Exception(f"Failed to get user info: {response.status}")
+                    data = await response.json()
+                    self.metrics.record_request(route, response.status, time.perf_counter() - started)
+                    return data
+                self.metrics.record_request(route, response.status, time.perf_counter() - started)
+                if response.status == 429 and attempt < MAX_RETRIES:
+                    try:
+                        data = await response.json(content_type=None)
+                    except ValueError:
+                        data = None
+                    if not isinstance(data, dict):
+                        data = {}  # 429 от Cloudflare приходит текстом или HTML - остаются только заголовки
+                    retry_after = float(data.get('retry_after') or response.headers.get('Retry-After')
+                                        or response.headers.get('X-RateLimit-Reset-After') or 1)
+                    is_global = bool(data.get('global')) or response.headers.get('X-RateLimit-Global') == 'true'
+                    self.rate_limiter.on_rate_limited(route, retry_after, is_global)
+                    self.metrics.record_rate_limited(route, retry_after, is_global)
+                    self._log(f"Превышен лимит запросов, повтор через {retry_after:.2f} с")
+                    continue
+                error_text = await response.text()
+                raise DiscordAPIError(f"{error}: {response.status} - {error_text}", response.status)
+
+    async def _cached_request(self, key: str, path: str, error: str, method: str = 'GET', **kwargs) -> Any:
+        """Запрос метаданных через кэш на диске: свежая запись избавляет от запроса к API"""
+        data = self.metadata.get(key)
+        if data is None:
+            data = await self._request(path, error, method, **kwargs)
+            self.metadata.put(key, data)
+        return data
+
+    async def get_user_info(self):
+        return await self._cached_request('user', '/users/@me', "Failed to get user info")
 
     async def get_guilds(self):
-        async with aiohttp.ClientSession(headers=self.headers) as session:
-            async with session.get('https://discord.com/api/v9/users/@me/guilds') as response:
-                if response.status == 200:
-                    return await response.json()
-                else:
-                    raise Exception(f"Failed to get guilds: {response.status}")
+        return await self._cached_request('guilds', '/users/@me/guilds', "Failed to get guilds")
+
+    async def get_channel(self, channel_id: int):
+        return await self._cached_request(f'channel:{channel_id}', f'/channels/{channel_id}', "Failed to get channel")
+
+    async def get_guild_channels(self, guild_id: int):
+        # last_message_id в кэше мог устареть, поэтому выгрузка сервера по нему каналы не отбрасывает
+        return await self._cached_request(f'guild_channels:{guild_id}', f'/guilds/{guild_id}/channels',
+                                          "Failed to get guild channels")
+
+    async def get_guild_roles(self, guild_id: int):
+        return await self._cached_request(f'guild_roles:{guild_id}', f'/guilds/{guild_id}/roles',
+                                          "Failed to get guild roles")
+
+    async def get_dm_channels(self):
+        # Без кэша: по last_message_id решается, есть ли в чате новые сообщения
+        return await self._request('/users/@me/channels', "Failed to get DM channels")
+
+    async def open_dm(self, user_id: int):
+        """Канал личных сообщений с пользователем; Discord создаёт его, если чата ещё не было"""
+        return await self._cached_request(f'dm:{user_id}', '/users/@me/channels', "Failed to open DM channel",
+                                          method='POST', json={'recipient_id': str(user_id)})
+
+    def _decode(self, data: Dict) -> Message:
+        return Message.from_api(data, self.authors, self.raw)
+
+    async def get_channel_messages(self, channel_id: int, limit: Optional[int] = None, before: Optional[Union[int, str]] = None, after: Optional[Union[int, str]] = None) -> AsyncIterator[List[Message]]:
+        """Постраничное получение истории канала, от новых сообщений к старым.
+
+        Асинхронный генератор: каждая страница (до 100 сообщений) отдаётся
+        сразу после получения, поэтому память не растёт с размером канала.
+        limit=None означает всю историю. before/after - snowflake ID границ:
+        before фильтрует сервер, а по after выгрузка останавливается, как
+        только курсор доходит до границы.
+        """
+        async for page in self._fetch_message_pages(channel_id, limit, before, after):
+            yield self._decode_page(page)
 
-    async def get_channel_messages(self, channel_id: int, limit: int = 100, before: Optional[str] = None, after: Optional[str] = None):
-        messages = []
+    def _decode_page(self, page: List[Dict]) -> List[Message]:
+        return [self._decode(message) for message in page]
+
+    async def _fetch_message_pages(self, channel_id: int, limit: Optional[int] = None, before: Optional[Union[int, str]] = None, after: Optional[Union[int, str]] = None) -> AsyncIterator[List[Dict]]:
+        """Страницы get_channel_messages в виде словарей API, без декодирования"""
+        total_messages = 0
         total_requests = 0
-        max_requests = 50  # Максимальное количество запросов (50 * 100 = 5000 сообщений)
+        after = int(after) if after else None
+
+        while limit is None or total_messages < limit:
+            # Каждый запрос получает максимум 100 сообщений
+            page_size = 100 if limit is None else min(100, limit - total_messages)
+            params = {'limit': page_size}  # Discord ограничивает 100 сообщениями за запрос
+            if before:
+                params['before'] = before  # Используем ID последнего сообщения для получения более старых сообщений
+
+            self._log(f"\nЗапрос #{total_requests + 1}: Получаем следующие {page_size} сообщений...")
+            # Ошибка прерывает выгрузку и выводится вызывающим: записанное уже сохранено,
+            # следующий запуск продолжит с контрольной точки
+            data = await self._request(f'/channels/{channel_id}/messages', "Failed to get messages", params=params)
+
+            total_requests += 1
+            new_messages = data
+            reached_after = False
+            if after and new_messages and int(new_messages[-1]['id']) <= after:
+                new_messages = [m for m in new_messages if int(m['id']) > after]
+                reached_after = True
+
+            if not new_messages:
+                self._log("Больше сообщений нет")
+                break
+
+            total_messages += len(new_messages)
+            self.metrics.record_page(channel_id, len(new_messages))
+            self._log(f"✓ Получено {len(new_messages)} сообщений в этом запросе")
+            self._log(f"  Всего получено: {total_messages}" + (f" из {limit}" if limit else "") + " сообщений")
+
+            yield new_messages
+
+            if reached_after or len(new_messages) < page_size:
+                self._log("Достигнут конец истории сообщений")
+                break
+
+            before = new_messages[-1]['id']  # Сохраняем ID последнего сообщения для следующего запроса
+
+        self._log(f"\nЗагрузка завершена. Всего получено {total_messages} сообщений за {total_requests} запросов.")
+
+    async def get_channel_messages_sliced(self, channel_id: int, slices: int, before: Optional[int] = None, after: Optional[int] = None) -> AsyncIterator[List[Message]]:
+        """Параллельная выгрузка канала, разбитого на slices временных срезов.
+
+        Диапазон snowflake между after (или созданием канала) и before (или
+        текущим моментом) делится на равные по времени части; каждая
+        выгружается своим курсором, а страницы отдаются в том же порядке,
+        что и у get_channel_messages - от новых к старым.
+        """
+        async for page in self._fetch_message_pages_sliced(channel_id, slices, before, after):
+            yield self._decode_page(page)
+
+    async def _fetch_message_pages_sliced(self, channel_id: int, slices: int, before: Optional[int] = None, after: Optional[int] = None) -> AsyncIterator[List[Dict]]:
+        if after is None:
+            # Сообщений старше канала нет; первое сообщение ветки имеет ID самой ветки
+            after = channel_id - 1
+        if before is None:
+            before = datetime_to_snowflake(datetime.now(timezone.utc) + timedelta(minutes=1))
+        low, high = snowflake_time_ms(after), snowflake_time_ms(before)
+        step = max((high - low) // slices, 1)
+        bounds = [before] + [((high - step * i) - DISCORD_EPOCH) << 22 for i in range(1, slices)] + [after]
+        self._log(f"Канал {channel_id}: выгрузка в {slices} параллельных срезов")
+
+        buffers = [SlicePages() for _ in range(slices)]
+
+        async def fetch_slice(index: int):
+            # Обе границы исключающие: внутренняя граница остаётся в срезе, который старше её
+            upper = bounds[index] if index == 0 else bounds[index] + 1
+            try:
+                async for page in self._fetch_message_pages(channel_id, None, upper, bounds[index + 1]):
+                    buffers[index].put(page)
+            except Exception as e:
+                buffers[index].error = e
+            finally:
+                buffers[index].finish()
+
+        tasks = [asyncio.create_task(fetch_slice(i)) for i in range(slices)]
+        try:
+            for buffer in buffers:
+                async for page in buffer.pages():
+                    yield page
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for buffer in buffers:
+                buffer.file.close()
+
+    def _ask_export_params(self):
+        """Запрос лимита и диапазона дат у пользователя"""
+        limit_input = input("Введите лимит сообщений (Enter для всей истории): ").strip()
+        limit = int(limit_input) if limit_input else None
         
-        async with aiohttp.ClientSession(headers=self.headers) as session:
-            while len(messages) < limit and total_requests < max_requests:
-                # Каждый запрос получает максимум 100 сообщений
-                params = {'limit': 100}  # Discord ограничивает 100 сообщениями за запрос
-                if before:
-                    params['before'] = before  # Используем ID последнего сообщения для получения более старых сообщений
-                if after:
-                    params['after'] = after
-
-                url = f'https://discord.com/api/v9/channels/{channel_id}/messages'
-                
-                try:
-                    print(f"\nЗапрос #{total_requests + 1}: Получаем следующие 100 сообщений...")
-                    async with session.get(url, params=params) as response:
-                        if response.status == 200:
-                            new_messages = await response.json()
-                            if not new_messages:
-                                print("Больше сообщений нет")
-                                break
-                                
-                            messages.extend(new_messages)
-                            total_requests += 1
-                            print(f"✓ Получено {len(new_messages)} сообщений в этом запросе")
-                            print(f"  Всего получено: {len(messages)} из {limit} сообщений")
-                            
-                            if len(new_messages) < 100:
-                                print("Достигнут конец истории сообщений")
-                                break
-                                
-                            before = new_messages[-1]['id']  # Сохраняем ID последнего сообщения для следующего запроса
-                            
-                            # Добавляем небольшую задержку между запросами
-                            await asyncio.sleep(0.5)
-                        else:
-                            error_text = await response.text()
-                            raise Exception(f"Failed to get messages: {response.status} - {error_text}")
-                except Exception as e:
-                    print(f"Ошибка при получении сообщений: {e}")
-                    break
-                    
-        print(f"\nЭкспорт завершен. Всего получено {len(messages)} сообщений за {total_requests} запросов.")
-        return messages
+        # Сообщения с начала даты начала до конца даты окончания включительно
+        after = parse_date_snowflake(input("Введите дату начала (YYYY-MM-DD, Enter для пропуска): ").strip())
+        before = parse_date_snowflake(input("Введите дату окончания (YYYY-MM-DD, Enter для пропуска): ").strip(), end_of_day=True)
+        return limit, before, after
 
-    async def export_channel(self, channel_id: int):
+    async def export_channel_interactive(self, channel_id: int):
+        """export_channel с параметрами, запрошенными в консоли"""
         try:
             print(f"Пытаемся получить доступ к каналу {channel_id}")
             
             # Спрашиваем параметры экспорта
-            limit_input = input("Введите лимит сообщений (Enter для максимального количества - 5000): ").strip()
-            limit = int(limit_input) if limit_input else 5000  # По умолчанию 5000 сообщений
-            
-            before = input("Введите дату начала (YYYY-MM-DD, Enter для пропуска): ").strip()
-            before = datetime.strptime(before, "%Y-%m-%d").isoformat() if before else None
-            
-            after = input("Введите дату окончания (YYYY-MM-DD, Enter для пропуска): ").strip()
-            after = datetime.strptime(after, "%Y-%m-%d").isoformat() if after else None
-
-            print(f"\nНачинаем экспорт до {limit} сообщений...")
-            messages = await self.get_channel_messages(channel_id, limit, before, after)
-            print(f"Экспорт завершен. Всего экспортировано {len(messages)} сообщений.")
-
-            # Экспортируем в выбранный формат
-            if self.output_format == 'json':
-                self._export_json(messages, channel_id)
-            elif self.output_format == 'html':
-                self._export_html(messages, channel_id)
-            elif self.output_format == 'txt':
-                self._export_txt(messages, channel_id)
-            elif self.output_format == 'csv':
-                self._export_csv(messages, channel_id)
-            else:
-                print(f"Неподдерживаемый формат: {self.output_format}")
+            limit, before, after = self._ask_export_params()
+            slices = 1
+            if limit is None:
+                slices_input = input("Число параллельных срезов по времени (Enter - 1): ").strip()
+                slices = max(int(slices_input), 1) if slices_input else 1
+
+            print(f"\nНачинаем экспорт {'всей истории' if limit is None else f'до {limit} сообщений'}...")
+            count = await self.export_channel(channel_id, limit=limit, before=before, after=after, slices=slices)
+            if count is not None:
+                print(f"Экспорт завершен. Всего экспортировано {count} сообщений.")
 
         except Exception as e:
             print(f"Ошибка при экспорте: {e}")
 
-    def _export_json(self, messages: List[Dict], channel_id: int):
-        output_file = self.output_dir / f'channel_{channel_id}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json'
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(messages, f, ensure_ascii=False, indent=2)
-        self.exported_files.append(output_file)
-        print(f"Экспорт в JSON завершён: {output_file}")
-
-    def _export_html(self, messages: List[Dict], channel_id: int):
-        template = """
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="utf-8">
-            <title>Discord Chat Export - Channel {{ channel_id }}</title>
-            <style>
-                body { font-family: Arial, sans-serif; margin: 20px; background: #36393f; color: #dcddde; }
-                .message { margin-bottom: 20px; padding: 10px; border-bottom: 1px solid #2f3136; }
-                .author { font-weight: bold; color: #7289da; }
-                .timestamp { color: #72767d; font-size: 0.8em; }
-                .content { margin: 5px 0; }
-                .attachment { color: #7289da; }
-                .embed { background: #2f3136; border-left: 4px solid #7289da; padding: 10px; margin: 5px 0; }
-                .reaction { display: inline-block; margin: 0 5px; }
-                .pinned { color: #faa61a; }
-            </style>
-        </head>
-        <body>
-            <h1>Экспорт чата: Channel {{ channel_id }}</h1>
-            {% for message in messages %}
-            <div class="message">
-                <div class="author">{{ message.author.username }}</div>
-                <div class="timestamp">{{ message.timestamp }}</div>
-                {% if message.content %}
-                <div class="content">{{ message.content }}</div>
-                {% endif %}
-                {% if message.attachments %}
-                <div class="attachments">
-                    {% for attachment in message.attachments %}
-                    <div class="attachment">📎 <a href="{{ attachment.url }}">{{ attachment.filename }}</a></div>
-                    {% endfor %}
-                </div>
-                {% endif %}
-                {% if message.embeds %}
-                <div class="embeds">
-                    {% for embed in message.embeds %}
-                    <div class="embed">
-                        {% if embed.title %}
-                        <div class="embed-title">{{ embed.title }}</div>
-                        {% endif %}
-                        {% if embed.description %}
-                        <div class="embed-description">{{ embed.description }}</div>
-                        {% endif %}
-                    </div>
-                    {% endfor %}
-                </div>
-                {% endif %}
-                {% if message.reactions %}
-                <div class="reactions">
-                    {% for reaction in message.reactions %}
-                    <span class="reaction">{{ reaction.emoji.name }} {{ reaction.count }}</span>
-                    {% endfor %}
-                </div>
-                {% endif %}
-                {% if message.pinned %}
-                <div class="pinned">📌 Закреплено</div>
-                {% endif %}
-            </div>
-            {% endfor %}
-        </body>
-        </html>
+    async def export_channel(self, channel_id: int, *, limit: Optional[int] = None, before: Optional[int] = None,
+                             after: Optional[int] = None, slices: int = 1) -> Optional[int]:
+        """Выгрузка одного канала в выбранные форматы без вопросов пользователю.
+
+        Возвращает число записанных сообщений; None - формат не поддерживается.
+        before/after - исключающие границы snowflake (parse_date_snowflake).
+
+        slices > 1 включает параллельную выгрузку по временным срезам (только
+        без лимита: лимит считается от самых новых сообщений). Выгрузка всей
+        истории идёт через контрольные точки манифеста: повторный запуск
+        докачивает только новые сообщения и незавершённые диапазоны.
+
+        Загрузка, декодирование, преобразование (вложения, локальная база) и
+        запись идут конвейером ExportPipeline: следующая страница
+        загружается, пока пишется текущая.
         """
-        output_file = self.output_dir / f'channel_{channel_id}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.html'
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(Template(template).render(messages=messages, channel_id=channel_id))
-        self.exported_files.append(output_file)
-        print(f"Экспорт в HTML завершён: {output_file}")
-
-    def _export_txt(self, messages: List[Dict], channel_id: int):
-        output_file = self.output_dir / f'channel_{channel_id}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.txt'
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(f"Экспорт чата: Channel {channel_id}\n")
-            f.write("=" * 50 + "\n\n")
-            for message in messages:
-                f.write(f"[{message['timestamp']}] {message['author']['username']}:\n")
-                if message['content']:
-                    f.write(f"{message['content']}\n")
-                if message['attachments']:
-                    for attachment in message['attachments']:
-                        f.write(f"[Вложение: {attachment['filename']}]\n")
-                if message['embeds']:
-                    f.write("[Эмбеды]\n")
-                f.write("\n")
-        self.exported_files.append(output_file)
-        print(f"Экспорт в TXT завершён: {output_file}")
-
-    def _export_csv(self, messages: List[Dict], channel_id: int):
-        output_file = self.output_dir / f'channel_{channel_id}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
-        with open(output_file, 'w', encoding='utf-8', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(['Timestamp', 'Author', 'Content', 'Attachments', 'Embeds', 'Reactions'])
-            for message in messages:
-                writer.writerow([
-                    message['timestamp'],
-                    message['author']['username'],
-                    message['content'],
-                    len(message.get('attachments', [])),
-                    len(message.get('embeds', [])),
-                    len(message.get('reactions', []))
-                ])
+        if not self._check_formats():
+            return None
+
+        output_files = {fmt: self._output_path(channel_id, fmt) for fmt in self.output_formats}
+        checkpointed = self.incremental and limit is None and before is None and after is None
+        if checkpointed:
+            items = self._checkpointed_pages(channel_id, [self._result_path(fmt, path) for fmt, path in output_files.items()], slices)
+        elif slices > 1 and limit is None:
+            items = self._unchecked_pages(self._fetch_message_pages_sliced(channel_id, slices, before, after))
+        else:
+            items = self._unchecked_pages(self._fetch_message_pages(channel_id, limit, before, after))
+
+        pipeline = ExportPipeline()
+        queue = pipeline.source('fetch', items)
+        queue = pipeline.map('decode', queue, self._decode_page)
+        if self.downloader is not None or self.store is not None or self.search_index is not None:
+            queue = pipeline.map('transform', queue, self._transform_page)
+        pages = pipeline.sink('write', queue)
+        try:
+            # Пустой канал (или диапазон без сообщений) не оставляет пустых файлов
+            try:
+                first_page = await pages.__anext__()
+            except StopAsyncIteration:
+                self._log(f"Канал {channel_id}: {'новых ' if checkpointed else ''}сообщений нет")
+                return 0
+            pages = self._prepend_page(first_page, pages)
+
+            # Экспортируем в выбранные форматы по мере получения страниц
+            return await self._write_outputs(pages, channel_id, output_files)
+        finally:
+            await pipeline.close()
+            self._report_pipeline(channel_id, pipeline)
+
+    def _report_pipeline(self, channel_id: int, pipeline: ExportPipeline):
+        stages = pipeline.stats()
+        if not any(stats['pages'] for stats in stages.values()):
+            return
+        self.metrics.record_pipeline(channel_id, stages)
+        rates = ', '.join(f"{name} {stats['messages_per_second'] or '-'}" for name, stats in stages.items())
+        self._log(f"Канал {channel_id}, сообщений/с по стадиям: {rates}; узкое место - {pipeline.bottleneck()}")
+
+    async def export_from_store(self, channel_id: int, before: Optional[int] = None, after: Optional[int] = None) -> Optional[int]:
+        """Рендер канала из локального хранилища без обращения к сети"""
+        if self.store is None:
+            raise ValueError("Local store is not configured")
+
+        async def pages():
+            for page in self.store.iter_pages(channel_id, before, after):
+                yield page
+
+        count = await self.export_pages(channel_id, pages())
+        if count is not None:
+            self._log(f"Экспорт из локальной базы завершен: {count} сообщений.")
+        return count
+
+    async def export_pages(self, channel_id: int, pages: AsyncIterator[List[Message]]) -> Optional[int]:
+        """Запись готового потока страниц (от новых к старым) во все форматы экспортера"""
+        if not self._check_formats():
+            return None
+        output_files = {fmt: self._output_path(channel_id, fmt) for fmt in self.output_formats}
+        return await self._write_outputs(pages, channel_id, output_files)
+
+    def _check_formats(self) -> bool:
+        unsupported = [fmt for fmt in self.output_formats if fmt not in SUPPORTED_FORMATS]
+        if unsupported:
+            print(f"Неподдерживаемый формат: {', '.join(unsupported)}")
+            return False
+        if 'parquet' in self.output_formats:
+            from discord_parquet import pyarrow
+            if pyarrow is None:
+                print("Для формата Parquet установите pyarrow: pip install pyarrow")
+                return False
+        return True
+
+    async def _write_outputs(self, pages: AsyncIterator[List[Message]], channel_id: int, output_files: Dict[str, Path]) -> int:
+        """Запись одного потока страниц во все форматы output_files.
+
+        Для одного формата писатель читает поток напрямую. Для нескольких
+        каждый писатель работает в своей задаче и читает свою очередь, а
+        страница берётся из потока дальше только после того, как её
+        обработали все писатели - контрольные точки остаются после записи.
+        """
+        if len(output_files) == 1:
+            (fmt, output_file), = output_files.items()
+            return await getattr(self, f'_export_{fmt}')(self.metrics.timed_pages(pages, fmt), channel_id, output_file)
+
+        queues = {fmt: asyncio.Queue(maxsize=FAN_OUT_QUEUE_SIZE) for fmt in output_files}
+
+        async def writer_pages(queue: asyncio.Queue) -> AsyncIterator[List[Message]]:
+            while True:
+                page = await queue.get()
+                if page is None:
+                    queue.task_done()
+                    return
+                try:
+                    yield page
+                finally:
+                    queue.task_done()
+
+        async def distribute():
+            async for page in pages:
+                for queue in queues.values():
+                    await queue.put(page)
+                await asyncio.gather(*(queue.join() for queue in queues.values()))
+            for queue in queues.values():
+                await queue.put(None)
+
+        writers = {
+            fmt: asyncio.create_task(getattr(self, f'_export_{fmt}')(
+                self.metrics.timed_pages(writer_pages(queues[fmt]), fmt), channel_id, output_file))
+            for fmt, output_file in output_files.items()
+        }
+        tasks = [asyncio.create_task(distribute()), *writers.values()]
+        try:
+            # Ошибка загрузки или любого писателя прерывает всю выгрузку канала
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                if task.exception() is not None:
+                    raise task.exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return writers[self.output_format].result()
+
+    async def _transform_page(self, page: List[Message]) -> List[Message]:
+        """Стадия преобразования: вложения в очередь загрузки, страница в локальную базу и индекс поиска"""
+        if self.downloader is not None:
+            await self.downloader.add_page(page)
+        if self.store is not None:
+            self.store.add_page(page)
+        if self.search_index is not None:
+            self.search_index.add_page(page)
+        return page
+
+    @staticmethod
+    async def _unchecked_pages(pages: AsyncIterator[List[Dict]]) -> AsyncIterator[PipelineItem]:
+        async for page in pages:
+            yield page, None
+
+    @staticmethod
+    async def _prepend_page(first_page: List[Message], pages: AsyncIterator[List[Message]]) -> AsyncIterator[List[Message]]:
+        yield first_page
+        async for page in pages:
+            yield page
+
+    async def _checkpointed_pages(self, channel_id: int, output_files: List[Path], slices: int = 1) -> AsyncIterator[PipelineItem]:
+        """Страницы всех незавершённых диапазонов канала с действиями контрольных точек.
+
+        Диапазоны идут от новых к старым, поэтому шард остаётся упорядоченным.
+        Контрольная точка страницы - действие элемента конвейера: манифест
+        обновляется, когда писатель запрашивает следующую страницу, то есть
+        после того, как эта записана.
+        """
+        entry = self.manifest.start_channel(channel_id, self.output_signature)
+        shard = {'files': [output_file.name for output_file in output_files], 'count': 0, 'newest_id': None, 'oldest_id': None}
+
+        def page_written(gap: List, upper: Optional[str], page: List[Dict]):
+            newest_id, oldest_id, count = page[0]['id'], page[-1]['id'], len(page)
+
+            def checkpoint():
+                if shard['newest_id'] is None:
+                    shard['newest_id'] = newest_id
+                    entry['shards'].append(shard)
+                if upper is None and (entry['newest_id'] is None or int(newest_id) > int(entry['newest_id'])):
+                    entry['newest_id'] = newest_id
+                shard['count'] += count
+                shard['oldest_id'] = oldest_id
+                if entry['oldest_id'] is None or int(oldest_id) < int(entry['oldest_id']):
+                    entry['oldest_id'] = oldest_id
+                gap[0] = oldest_id
+                self.manifest.save()
+            return checkpoint
+
+        def gap_done(gap: List):
+            def checkpoint():
+                entry['gaps'].remove(gap)
+                self.manifest.save()
+            return checkpoint
+
+        for gap in list(entry['gaps']):
+            upper, lower = gap
+            if upper is None and lower is None and slices > 1:
+                pages = self._fetch_message_pages_sliced(channel_id, slices)
+            else:
+                pages = self._fetch_message_pages(channel_id, None, upper, lower)
+            async for page in pages:
+                yield page, page_written(gap, upper, page)
+            yield None, gap_done(gap)
+
+    async def export_category(self, category_id: int):
+        try:
+            category = await self.get_channel(category_id)
+            if category.get('type') != 4:
+                print(f"Канал {category_id} не является категорией")
+                return
+            channels = await self.get_guild_channels(int(category['guild_id']))
+            channels = [c for c in channels if c.get('parent_id') == str(category_id)]
+            print(f"Категория {category.get('name', category_id)}: найдено {len(channels)} каналов")
+            limit, before, after = self._ask_export_params()
+            await self._export_channels(channels, limit, before, after)
+        except Exception as e:
+            print(f"Ошибка при экспорте категории: {e}")
+
+    async def export_dm(self, user_id: Optional[int] = None):
+        """Личные сообщения с пользователем, а без user_id - все личные и групповые чаты аккаунта"""
+        try:
+            if user_id is not None:
+                # Из кэша берётся только ID канала: last_message_id в нём мог устареть
+                channel_id = int((await self.open_dm(user_id))['id'])
+                limit, before, after = self._ask_export_params()
+                count = await self.export_channel(channel_id, limit=limit, before=before, after=after)
+                if count is not None:
+                    print(f"Экспорт завершен. Всего экспортировано {count} сообщений.")
+                return
+            # Список чатов не кэшируется, поэтому пустые можно пропустить по last_message_id
+            channels = [c for c in await self.get_dm_channels() if c.get('last_message_id')]
+            print(f"Найдено {len(channels)} личных и групповых чатов")
+            limit, before, after = self._ask_export_params()
+            if self.incremental and limit is None and before is None and after is None:
+                # Чаты, выгруженные до последнего сообщения, не стоят ни одного запроса
+                changed = [channel for channel in channels if self._has_new_messages(channel)]
+                if len(changed) < len(channels):
+                    print(f"Без новых сообщений: {len(channels) - len(changed)} чатов")
+                channels = changed
+            await self._export_channels(channels, limit, before, after)
+        except Exception as e:
+            print(f"Ошибка при экспорте личных сообщений: {e}")
+
+    def _has_new_messages(self, channel: Dict) -> bool:
+        """False - по манифесту канал полностью выгружен до его last_message_id"""
+        entry = self.manifest.channel(int(channel['id']), self.output_signature)
+        if entry is None or entry['gaps'] or entry['newest_id'] is None:
+            return True
+        return int(channel.get('last_message_id') or 0) > int(entry['newest_id'])
+
+    async def export_guild(self, guild_id: int):
+        try:
+            channels = await self.get_guild_channels(guild_id)
+            print(f"Сервер {guild_id}: найдено {len(channels)} каналов")
+            limit, before, after = self._ask_export_params()
+            await self._export_channels(channels, limit, before, after)
+        except Exception as e:
+            print(f"Ошибка при экспорте сервера: {e}")
+
+    @staticmethod
+    def _channel_label(channel: Dict) -> str:
+        """#имя канала сервера или @собеседники личного чата"""
+        if channel.get('name'):
+            return f"#{channel['name']}"
+        recipients = [user.get('global_name') or user.get('username') for user in channel.get('recipients') or ()]
+        return '@' + ', '.join(recipients) if recipients else str(channel['id'])
+
+    @staticmethod
+    def _estimate_channel_size(channel: Dict) -> int:
+        """Оценка объёма истории: время между созданием канала и последним сообщением"""
+        last_message_id = channel.get('last_message_id')
+        if not last_message_id:
+            return 0
+        return snowflake_time_ms(last_message_id) - snowflake_time_ms(channel['id'])
+
+    async def _export_channels(self, channels: List[Dict], limit: Optional[int] = None, before: Optional[int] = None, after: Optional[int] = None, explicit: bool = False) -> Dict[int, Optional[int]]:
+        """Параллельная выгрузка каналов пулом из max_concurrency воркеров.
+
+        Самые крупные каналы планируются первыми, чтобы длинная выгрузка не
+        оказалась в конце очереди. Все воркеры делят один RateLimiter.
+        Из списков сервера берутся только текстовые каналы, в том числе с
+        пустым last_message_id: в кэшированном списке он мог устареть, а
+        выгрузка пустого канала стоит одного запроса. explicit=True - каналы указаны явно и выгружаются все, в том числе
+        ветки и текстовые чаты голосовых каналов.
+        """
+        text_channels = [c for c in channels if explicit or (
+            c.get('type') in TEXT_CHANNEL_TYPES + DM_CHANNEL_TYPES)]
+        text_channels.sort(key=self._estimate_channel_size, reverse=True)
+        self._log(f"К экспорту: {len(text_channels)} каналов, параллельно до {self.max_concurrency}")
+
+        queue: asyncio.Queue = asyncio.Queue()
+        for channel in text_channels:
+            queue.put_nowait(channel)
+        results: Dict[int, Optional[int]] = {}
+
+        async def worker():
+            while True:
+                try:
+                    channel = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                channel_id = int(channel['id'])
+                try:
+                    self._log(f"Экспорт канала {self._channel_label(channel)} ({channel_id})")
+                    results[channel_id] = await self.export_channel(channel_id, limit=limit, before=before, after=after)
+                except Exception as e:
+                    print(f"Ошибка при экспорте канала {channel_id}: {e}")
+                    results[channel_id] = None
+
+        await asyncio.gather(*(worker() for _ in range(min(self.max_concurrency, len(text_channels)))))
+        exported = sum(count or 0 for count in results.values())
+        self._log(f"Экспорт завершен: {len(results)} каналов, {exported} сообщений.")
+        return results
+
+    async def export_channels(self, channel_ids: Iterable[int], *, limit: Optional[int] = None,
+                              before: Optional[int] = None, after: Optional[int] = None) -> Dict[int, Optional[int]]:
+        """Параллельная выгрузка каналов по ID без вопросов пользователю.
+
+        Каналы любого типа, включая ветки; результат - число сообщений по
+        каналу, None - ошибка.
+        """
+        channels = []
+        failed: Dict[int, Optional[int]] = {}
+        for channel_id in channel_ids:
+            try:
+                channels.append(await self.get_channel(channel_id))
+            except Exception as e:
+                print(f"Ошибка при экспорте канала {channel_id}: {e}")
+                failed[int(channel_id)] = None
+        results = await self._export_channels(channels, limit, before, after, explicit=True)
+        return {**results, **failed}
+
+    def _finish_output(self, output_file: Path, channel_id: int, output_format: str):
         self.exported_files.append(output_file)
-        print(f"Экспорт в CSV завершён: {output_file}")
+        self.metrics.record_output(channel_id, output_format, output_file)
+
+    def _output_path(self, channel_id: int, extension: str) -> Path:
+        """Имя файла формата без суффикса сжатия; части и индекс строятся от него"""
+        stem = f'channel_{channel_id}_{datetime.now().strftime("%Y%m%d_%H%M%S")}'
+        output_file = self.output_dir / f'{stem}.{extension}'
+        suffix = 1
+        while self._output_taken(output_file):
+            # Несколько шардов одного канала за одну секунду
+            output_file = self.output_dir / f'{stem}_{suffix}.{extension}'
+            suffix += 1
+        return output_file
+
+    def _output_taken(self, output_file: Path) -> bool:
+        first_part = output_file.with_name(f'{output_file.stem}.part001{output_file.suffix}')
+        return (output_file.exists() or output_file.with_name(output_file.name + '.index.json').exists()
+                or any(compressed_path(path, self.compression).exists() for path in (output_file, first_part)))
+
+    def _result_path(self, output_format: str, output_file: Path) -> Path:
+        if output_format == 'parquet':
+            return output_file  # сжатие внутри файла, без нарезки на части
+        limited = bool(self.shard_bytes or self.shard_messages or (output_format == 'html' and self.html_page_size))
+        return result_path(output_file, self.compression, limited)
+
+    def _open_output(self, output_file: Path, channel_id: int, output_format: str, **kwargs) -> ShardedOutput:
+        kwargs.setdefault('max_bytes', self.shard_bytes)
+        kwargs.setdefault('max_messages', self.shard_messages)
+        return ShardedOutput(output_file, self.compression,
+                             on_part=lambda path: self._finish_output(path, channel_id, output_format), **kwargs)
+
+    async def _resolve_tables(self, tables: LookupTables, channel_id: int):
+        """Данные каналов и ролей для таблиц нормализованного экспорта"""
+        for table_channel_id, data in list(tables.channels.items()):
+            if data is not None:
+                continue
+            try:
+                tables.set_channel(await self.get_channel(int(table_channel_id)))
+            except Exception as e:
+                self._log(f"Не удалось получить канал {table_channel_id} для таблиц: {e}")
+        guild_id = (tables.channels.get(str(channel_id)) or {}).get('guild_id')
+        if not tables.roles or not guild_id:
+            return
+        try:
+            for role in await self.get_guild_roles(int(guild_id)):
+                tables.set_role(role)
+        except Exception as e:
+            self._log(f"Не удалось получить роли сервера {guild_id}: {e}")
+
+    async def _render(self, output_format: str, page: List[Message]) -> List[str]:
+        """Тексты сообщений страницы; с render_executor - в пуле, иначе в цикле событий"""
+        options = {
+            'json': {'indent': self.json_indent, 'normalized': self.normalized},
+            'jsonl': {'normalized': self.normalized},
+            'csv': {'normalized': self.normalized},
+        }.get(output_format, {})
+        return await self._run_render(partial(RENDERERS[output_format], page, **options))
+
+    async def _run_render(self, render: Callable[[], Any]) -> Any:
+        if self.render_executor is None:
+            return render()
+        if self.render_pool is None:
+            pool_class = ProcessPoolExecutor if self.render_executor == 'process' else ThreadPoolExecutor
+            self.render_pool = pool_class(max_workers=self.render_workers)
+        return await asyncio.get_running_loop().run_in_executor(self.render_pool, render)
+
+    def _write_tables(self, output_file: Path, channel_id: int, output_format: str, tables: LookupTables):
+        """Таблицы рядом с выводом: <имя>.tables.json, для CSV - <имя>.authors.csv"""
+        if output_format == 'csv':
+            tables_file = output_file.with_name(output_file.name + '.authors.csv')
+            import csv
+            with open(tables_file, 'w', encoding='utf-8', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['Author ID', 'Username', 'Global Name', 'Discriminator', 'Avatar', 'Bot'])
+                writer.writerows([
+                    author_id, author.get('username'), author.get('global_name'),
+                    author.get('discriminator'), author.get('avatar'), bool(author.get('bot'))
+                ] for author_id, author in tables.authors.items())
+        else:
+            tables_file = output_file.with_name(output_file.name + '.tables.json')
+            with open(tables_file, 'w', encoding='utf-8') as f:
+                f.write(json_dumps(tables.to_dict(), self.json_indent))
+        self._finish_output(tables_file, channel_id, output_format)
+
+    async def _export_json(self, pages: AsyncIterator[List[Message]], channel_id: int, output_file: Optional[Path] = None) -> int:
+        output_file = output_file or self._output_path(channel_id, 'json')
+        # Пишем JSON-массив по одному сообщению, не держа историю в памяти
+        output = self._open_output(output_file, channel_id, 'json', header='[',
+                                   footer=lambda count: '\n]' if count else ']')
+        separator = '\n  ' if self.json_indent else '\n'
+        tables = LookupTables() if self.normalized else None
+        try:
+            async for page in pages:
+                for message, text in zip(page, await self._render('json', page)):
+                    first = output.start_message(message.id)
+                    output.write(separator if first else ',' + separator)
+                    output.write(text)
+                    if tables is not None:
+                        tables.add(message)
+                output.flush()
+            if tables is not None:
+                await self._resolve_tables(tables, channel_id)
+        finally:
+            # Закрываем массив и при обрыве, чтобы шард остался валидным
+            output.close()
+            if tables is not None:
+                self._write_tables(output_file, channel_id, 'json', tables)
+        self._log(f"Экспорт в JSON завершён: {output.result_path}")
+        return output.total
+
+    async def _export_jsonl(self, pages: AsyncIterator[List[Message]], channel_id: int, output_file: Optional[Path] = None) -> int:
+        output_file = output_file or self._output_path(channel_id, 'jsonl')
+        # JSON Lines: одно сообщение в строке, файл можно дописывать и читать потоково
+        output = self._open_output(output_file, channel_id, 'jsonl')
+        tables = LookupTables() if self.normalized else None
+        try:
+            async for page in pages:
+                for message, text in zip(page, await self._render('jsonl', page)):
+                    output.start_message(message.id)
+                    output.write(text)
+                    if tables is not None:
+                        tables.add(message)
+                output.flush()
+            if tables is not None:
+                await self._resolve_tables(tables, channel_id)
+        finally:
+            output.close()
+            if tables is not None:
+                self._write_tables(output_file, channel_id, 'jsonl', tables)
+        self._log(f"Экспорт в JSON Lines завершён: {output.result_path}")
+        return output.total
+
+    async def _export_html(self, pages: AsyncIterator[List[Message]], channel_id: int, output_file: Optional[Path] = None) -> int:
+        output_file = output_file or self._output_path(channel_id, 'html')
+        # Страницы HTML - части вывода: переключаются по html_page_size или лимитам нарезки
+        output = self._open_output(output_file, channel_id, 'html', paged=True,
+                                   max_messages=self.html_page_size or self.shard_messages)
+        source = pages.__aiter__()
+        pending: List[Tuple[Message, str]] = []  # сообщения полученной страницы API с разметкой, в обратном порядке
+        exhausted = False
+        error = None
+
+        async def next_message() -> Optional[Tuple[Message, str]]:
+            nonlocal exhausted, error
+            while not pending:
+                if exhausted:
+                    return None
+                output.flush()
+                try:
+                    page = await source.__anext__()
+                except StopAsyncIteration:
+                    exhausted = True
+                    return None
+                except Exception as e:
+                    # Даём шаблону дописать окончание страницы, ошибку поднимаем после
+                    error = e
+                    exhausted = True
+                    return None
+                pending.extend(reversed(list(zip(page, await self._render('html', page)))))
+            return pending.pop()
+
+        async def messages(nav: Dict):
+            while not output.full:
+                item = await next_message()
+                if item is None:
+                    return
+                message, html = item
+                output.start_message(message.id)
+                yield html
+            # Страница заполнена: ссылку на следующую ставим, только если есть что на ней показать
+            item = await next_message()
+            if item is not None:
+                pending.append(item)
+                nav['next'] = output.part_path(nav['number'] + 1).name
+
+        paginated = bool(output.max_messages or output.max_bytes)
+        number = 1
+        try:
+            while True:
+                nav = {
+                    'number': number,
+                    'page': number if paginated else None,
+                    'prev': output.part_path(number - 1).name if number > 1 else None,
+                    'next': None,
+                }
+                # Шаблон рендерится потоком: сообщения подтягиваются по мере поступления страниц
+                async for chunk in html_template().generate_async(messages=messages(nav), channel_id=channel_id, nav=nav):
+                    output.write(chunk)
+                if not nav['next']:
+                    break
+                output.new_part()
+                number += 1
+        finally:
+            output.close()
+        if error is not None:
+            raise error
+        self._log(f"Экспорт в HTML завершён: {output.result_path}" + (f" ({number} стр.)" if number > 1 else ""))
+        return output.total
+
+    async def _export_txt(self, pages: AsyncIterator[List[Message]], channel_id: int, output_file: Optional[Path] = None) -> int:
+        output_file = output_file or self._output_path(channel_id, 'txt')
+        output = self._open_output(output_file, channel_id, 'txt',
+                                   header=f"Экспорт чата: Channel {channel_id}\n" + "=" * 50 + "\n\n")
+        try:
+            async for page in pages:
+                for message, text in zip(page, await self._render('txt', page)):
+                    output.start_message(message.id)
+                    output.write(text)
+                output.flush()
+        finally:
+            output.close()
+        self._log(f"Экспорт в TXT завершён: {output.result_path}")
+        return output.total
+
+    async def _export_csv(self, pages: AsyncIterator[List[Message]], channel_id: int, output_file: Optional[Path] = None) -> int:
+        output_file = output_file or self._output_path(channel_id, 'csv')
+        # В нормализованном виде вместо имени автора - author_id, авторы в <имя>.authors.csv
+        author_column = 'Author ID' if self.normalized else 'Author'
+        output = self._open_output(output_file, channel_id, 'csv',
+                                   header=f'Timestamp,{author_column},Content,Attachments,Embeds,Reactions\r\n')
+        tables = LookupTables() if self.normalized else None
+        try:
+            async for page in pages:
+                for message, text in zip(page, await self._render('csv', page)):
+                    output.start_message(message.id)
+                    output.write(text)
+                    if tables is not None:
+                        tables.add(message)
+                output.flush()
+        finally:
+            output.close()
+            if tables is not None:
+                self._write_tables(output_file, channel_id, 'csv', tables)
+        self._log(f"Экспорт в CSV завершён: {output.result_path}")
+        return output.total
+
+    async def _export_parquet(self, pages: AsyncIterator[List[Message]], channel_id: int, output_file: Optional[Path] = None) -> int:
+        output_file = output_file or self._output_path(channel_id, 'parquet')
+        # Колоночный формат: типизированные колонки, страницы копятся в группы строк
+        from discord_parquet import ParquetOutput, record_batch
+        output = ParquetOutput(output_file, self.compression)
+        try:
+            async for page in pages:
+                output.write_batch(await self._run_render(partial(record_batch, page)))
+        finally:
+            output.close()
+            self._finish_output(output_file, channel_id, 'parquet')
+        self._log(f"Экспорт в Parquet завершён: {output_file}")
+        return output.total
+
+async def export_channels(channel_ids: Iterable[int], token: Optional[str] = None, limit: Optional[int] = None,
+                          before: Optional[int] = None, after: Optional[int] = None,
+                          **options) -> Dict[int, Optional[int]]:
+    """Выгрузка каналов из кода, без вопросов в консоли и без .env.
+
+    options - параметры DiscordExporter (output_format, output_dir,
+    compression, max_concurrency...). Каналы выгружаются параллельно любого
+    типа, включая ветки; результат - число сообщений по каналу, None - ошибка.
+    """
+    async with DiscordExporter(token=token, **options) as exporter:
+        return await exporter.export_channels(channel_ids, limit=limit, before=before, after=after)
 
 async def main():
+    # Загрузка переменных окружения
+    from dotenv import load_dotenv
+    load_dotenv()
+
     print("Выберите формат экспорта:")
     print("1. JSON")
     print("2. HTML")
     print("3. TXT")
     print("4. CSV")
-    format_choice = input("Выберите формат (1-4): ").strip()
+    print("5. JSON Lines")
+    print("6. Parquet (нужен pyarrow)")
+    format_choice = input("Выберите формат (1-6, несколько через запятую - за одну выгрузку): ").strip()
     
     format_map = {
         "1": "json",
         "2": "html",
         "3": "txt",
-        "4": "csv"
+        "4": "csv",
+        "5": "jsonl",
+        "6": "parquet"
     }
     
-    if format_choice not in format_map:
+    choices = [choice.strip() for choice in format_choice.split(',')]
+    if not all(choice in format_map for choice in choices):
         print("Неверный выбор формата!")
         return
         
-    output_format = format_map[format_choice]
-    exporter = DiscordExporter(output_format=output_format)
-    
+    output_formats = [format_map[choice] for choice in choices]
+    html_page_size = None
+    if 'html' in output_formats:
+        page_size_input = input("Сообщений на одну HTML-страницу (Enter - всё в одном файле): ").strip()
+        html_page_size = int(page_size_input) if page_size_input else None
+    compression = input("Сжатие файлов (Enter - без сжатия, gzip, zstd): ").strip().lower() or None
+    if compression not in COMPRESSION_EXTENSIONS:
+        print("Неверный выбор сжатия!")
+        return
+    if compression == 'zstd':
+        try:
+            check_compression(compression)
+        except ValueError:
+            print("Для сжатия zstd установите zstandard: pip install zstandard")
+            return
+    shard_input = input("Сообщений в одной части файла (Enter - один файл): ").strip()
+    shard_messages = int(shard_input) if shard_input else None
+    store_path = input("Путь к локальной базе SQLite (Enter - не использовать): ").strip() or None
+    search_index_path = input("Путь к индексу поиска (Enter - не строить): ").strip() or None
+    normalized = bool(set(output_formats) & {'json', 'jsonl', 'csv'}) and input(
+        "Вынести авторов, роли и каналы в отдельные таблицы? (y/N): ").strip().lower() == 'y'
+    download_attachments = input("Скачивать вложения? (y/N): ").strip().lower() == 'y'
+    render_executor = input("Рендер в пуле (Enter - в основном потоке, thread, process): ").strip().lower() or None
+    if render_executor is not None and render_executor not in RENDER_EXECUTORS:
+        print("Неверный выбор пула!")
+        return
+    refresh_metadata = input("Обновить кэш серверов и каналов? (y/N): ").strip().lower() == 'y'
+    async with DiscordExporter(output_format=output_formats, store_path=store_path, html_page_size=html_page_size,
+                               download_attachments=download_attachments, compression=compression,
+                               shard_messages=shard_messages, search_index_path=search_index_path,
+                               normalized=normalized, render_executor=render_executor,
+                               refresh_metadata=refresh_metadata) as exporter:
+        if store_path and input("Экспортировать из локальной базы без сети? (y/N): ").strip().lower() == 'y':
+            await run_offline(exporter)
+        else:
+            await run_interactive(exporter)
+
+async def run_offline(exporter: DiscordExporter):
+    channel_ids = exporter.store.channel_ids()
+    print(f"Каналы в базе: {channel_ids}")
+    channel_id = input("Введите ID канала (Enter - все каналы): ").strip()
+    if channel_id and not channel_id.isdigit():
+        print("ID канала должен быть числом!")
+        return
+    for cid in ([int(channel_id)] if channel_id else channel_ids):
+        await exporter.export_from_store(cid)
+
+async def run_interactive(exporter: DiscordExporter):
     # Получаем информацию о пользователе
     try:
         user_info = await exporter.get_user_info()
@@ -289,7 +1315,7 @@ async def main():
             if not channel_id.isdigit():
                 print("ID канала должен быть числом!")
                 return
-            await exporter.export_channel(int(channel_id))
+            await exporter.export_channel_interactive(int(channel_id))
         elif choice == "2":
             category_id = input("Введите ID категории: ").strip()
             if not category_id.isdigit():
@@ -303,11 +1329,11 @@ async def main():
                 return
             await exporter.export_guild(int(guild_id))
         elif choice == "4":
-            user_id = input("Введите ID пользователя для экспорта личных сообщений: ").strip()
-            if not user_id.isdigit():
+            user_id = input("Введите ID пользователя для экспорта личных сообщений (Enter - все чаты): ").strip()
+            if user_id and not user_id.isdigit():
                 print("ID пользователя должен быть числом!")
                 return
-            await exporter.export_dm(int(user_id))
+            await exporter.export_dm(int(user_id) if user_id else None)
         else:
             print("Неверный выбор!")
             return
@@ -0,0 +1,437 @@
+"""Пакетная выгрузка без вопросов в консоли: очередь заданий с приоритетами.
+
+Задания описываются файлом JSON (или YAML, если установлен PyYAML) либо
+аргументами командной строки и попадают в постоянную очередь SQLite.
+Один процесс выбирает задания по приоритету и выгружает их с общим
+ограничением параллельности, общей сессией и общим бюджетом лимитов API:
+
+    python discord_jobs.py add jobs.json
+    python discord_jobs.py add --channel 123 --format json,csv --from 2024-01-01 --priority 10
+    python discord_jobs.py run --concurrency 4
+    python discord_jobs.py status
+
+Файл заданий:
+
+    {
+      "defaults": {"format": "json", "output_dir": "exports", "compression": "gzip"},
+      "jobs": [
+        {"channel": 123, "priority": 10, "from": "2024-01-01", "to": "2024-03-31"},
+        {"guild": 456, "format": "jsonl,parquet"},
+        {"category": 789, "limit": 1000}
+      ]
+    }
+
+Задание сервера или категории при запуске раскрывается в задания его
+текстовых каналов с тем же приоритетом, крупные каналы - первыми.
+Прерванные задания при следующем запуске возвращаются в очередь и
+продолжаются с контрольных точек manifest.json.
+"""
+import sys
+import json
+import time
+import sqlite3
+import asyncio
+import argparse
+from datetime import date
+from pathlib import Path
+from typing import Optional, List, Dict, Any, Union, Tuple
+
+try:
+    import yaml  # файлы заданий в YAML, если установлен
+except ImportError:
+    yaml = None
+
+from discord_exporter import (DiscordExporter, ExportManifest, SUPPORTED_FORMATS, TEXT_CHANNEL_TYPES,
+                              MAX_CONCURRENT_CHANNELS, parse_date_snowflake)
+from discord_output import check_compression
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    parent_id INTEGER REFERENCES jobs(id),
+    priority INTEGER NOT NULL DEFAULT 0,
+    size INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    spec TEXT NOT NULL,
+    messages INTEGER,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_queue ON jobs(status, priority DESC, size DESC, id);
+"""
+
+TARGETS = ('channel', 'category', 'guild')
+# Поля задания -> параметры DiscordExporter
+EXPORTER_OPTIONS = {
+    'format': 'output_format',
+    'output_dir': 'output_dir',
+    'incremental': 'incremental',
+    'compression': 'compression',
+    'shard_messages': 'shard_messages',
+    'shard_bytes': 'shard_bytes',
+    'html_page_size': 'html_page_size',
+    'json_indent': 'json_indent',
+    'normalized': 'normalized',
+    'raw': 'raw',
+    'download_attachments': 'download_attachments',
+    'store_path': 'store_path',
+    'search_index_path': 'search_index_path',
+    'render_executor': 'render_executor',
+}
+JOB_FIELDS = set(TARGETS) | set(EXPORTER_OPTIONS) | {'priority', 'limit', 'from', 'to', 'slices'}
+MAX_JOB_ATTEMPTS = 3  # запусков задания до статуса failed
+PROGRESS_INTERVAL = 10  # секунд между строками прогресса
+
+def load_spec(path: Union[str, Path]) -> List[Dict[str, Any]]:
+    """Задания из файла JSON/YAML с применёнными defaults"""
+    path = Path(path)
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.suffix in ('.yml', '.yaml'):
+            if yaml is None:
+                raise ValueError("YAML job specs require the PyYAML package")
+            try:
+                data = yaml.safe_load(f)
+            except yaml.YAMLError as e:
+                raise ValueError(f"{path}: {e}") from None
+        else:
+            data = json.load(f)
+    if isinstance(data, list):
+        data = {'jobs': data}
+    if not isinstance(data, dict):
+        raise ValueError(f"{path}: expected a list of jobs or a mapping with 'jobs'")
+    defaults = data.get('defaults') or {}
+    jobs = data.get('jobs') or ()
+    if not isinstance(defaults, dict) or not all(isinstance(job, dict) for job in jobs):
+        raise ValueError(f"{path}: jobs and defaults must be mappings")
+    return [dict(defaults, **job) for job in jobs]
+
+def validate_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Проверенная копия задания; даты from/to приводятся к строкам YYYY-MM-DD"""
+    job = dict(job)
+    targets = [target for target in TARGETS if job.get(target) is not None]
+    if len(targets) != 1:
+        raise ValueError(f"Job needs exactly one of {', '.join(TARGETS)}: {job}")
+    unknown = set(job) - JOB_FIELDS
+    if unknown:
+        raise ValueError(f"Unknown job fields: {', '.join(sorted(unknown))}")
+    formats = job.get('format') or 'json'
+    for fmt in (formats.split(',') if isinstance(formats, str) else formats):
+        if fmt.strip().lower() not in SUPPORTED_FORMATS:
+            raise ValueError(f"Unsupported output format: {fmt}")
+    check_compression(job.get('compression'))
+    for field in ('from', 'to'):
+        value = job.get(field)
+        if isinstance(value, date):
+            # YAML читает дату без кавычек как datetime.date
+            job[field] = value = value.strftime('%Y-%m-%d')
+        if value and not isinstance(value, str):
+            raise ValueError(f"Job field '{field}' must be a YYYY-MM-DD date: {value!r}")
+        if value:
+            parse_date_snowflake(value)  # ValueError на неверной дате
+    return job
+
+def job_target(job: Dict[str, Any]) -> Tuple[str, int]:
+    target = next(target for target in TARGETS if job.get(target) is not None)
+    return target, int(job[target])
+
+class JobQueue:
+    """Постоянная очередь заданий в SQLite: приоритет, затем размер канала, затем порядок добавления"""
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def add(self, job: Dict[str, Any], parent_id: Optional[int] = None, size: int = 0) -> Optional[int]:
+        """ID нового задания; None - такое же задание уже ждёт в очереди"""
+        spec = json.dumps(validate_job(job), sort_keys=True, ensure_ascii=False)
+        with self.conn:
+            if self.conn.execute("SELECT 1 FROM jobs WHERE spec = ? AND status IN ('queued', 'running')",
+                                 (spec,)).fetchone():
+                return None
+            cursor = self.conn.execute(
+                'INSERT INTO jobs (parent_id, priority, size, spec, created_at) VALUES (?, ?, ?, ?, ?)',
+                (parent_id, int(job.get('priority') or 0), size, spec, time.time()))
+        return cursor.lastrowid
+
+    def recover(self) -> int:
+        """Задания, прерванные вместе с прошлым процессом, - обратно в очередь"""
+        with self.conn:
+            return self.conn.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'").rowcount
+
+    def claim(self) -> Optional[Tuple[int, Dict[str, Any]]]:
+        """Следующее задание по приоритету, помеченное running"""
+        with self.conn:
+            row = self.conn.execute(
+                "SELECT id, spec FROM jobs WHERE status = 'queued' ORDER BY priority DESC, size DESC, id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            self.conn.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ? WHERE id = ?",
+                              (time.time(), row[0]))
+        return row[0], json.loads(row[1])
+
+    def finish(self, job_id: int, messages: Optional[int], status: str = 'done'):
+        with self.conn:
+            self.conn.execute('UPDATE jobs SET status = ?, messages = ?, error = NULL, finished_at = ? WHERE id = ?',
+                              (status, messages, time.time(), job_id))
+
+    def fail(self, job_id: int, error: str) -> bool:
+        """Ошибка задания; True - попытки остались и оно снова в очереди"""
+        with self.conn:
+            attempts, = self.conn.execute('SELECT attempts FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            status = 'queued' if attempts < MAX_JOB_ATTEMPTS else 'failed'
+            self.conn.execute('UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?',
+                              (status, error, time.time(), job_id))
+        return status == 'queued'
+
+    def counts(self) -> Dict[str, int]:
+        return dict(self.conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+
+    def jobs(self, status: Optional[str] = None) -> List[Dict[str, Any]]:
+        sql = 'SELECT id, parent_id, priority, status, attempts, spec, messages, error, started_at, finished_at FROM jobs'
+        params: List[Any] = []
+        if status:
+            sql += ' WHERE status = ?'
+            params.append(status)
+        sql += ' ORDER BY id'
+        return [{
+            'id': row[0], 'parent_id': row[1], 'priority': row[2], 'status': row[3], 'attempts': row[4],
+            'spec': json.loads(row[5]), 'messages': row[6], 'error': row[7],
+            'seconds': round(row[9] - row[8], 1) if row[8] and row[9] else None,
+        } for row in self.conn.execute(sql, params)]
+
+class JobRunner:
+    """Выполнение очереди в одном процессе.
+
+    concurrency воркеров берут задания из очереди, пока она не опустеет.
+    Для каждого набора настроек вывода создаётся свой DiscordExporter, но
+    все они делят одну сессию, лимиты запросов и кэш метаданных, а
+    экспортеры с общим output_dir - и манифест контрольных точек.
+    exporter_options - параметры всех экспортеров (token, api_base...).
+    """
+
+    def __init__(self, queue: JobQueue, concurrency: int = MAX_CONCURRENT_CHANNELS,
+                 progress_interval: float = PROGRESS_INTERVAL, exporter_options: Optional[Dict[str, Any]] = None):
+        self.queue = queue
+        self.concurrency = concurrency
+        self.progress_interval = progress_interval
+        self.exporter_options = exporter_options or {}
+        self.exporters: Dict[str, DiscordExporter] = {}
+        self.manifests: Dict[Path, ExportManifest] = {}  # output_dir -> манифест
+        self.base: Optional[DiscordExporter] = None
+        self.running: Dict[int, Dict[str, Any]] = {}  # задание -> канал, сообщения, начало
+        self.expanding = 0  # заданий серверов и категорий, которые сейчас раскрываются
+        self.done = 0
+        self.failed = 0
+
+    async def _exporter(self, job: Dict[str, Any]) -> DiscordExporter:
+        options = {EXPORTER_OPTIONS[field]: job[field] for field in EXPORTER_OPTIONS if field in job}
+        key = json.dumps(options, sort_keys=True)
+        exporter = self.exporters.get(key)
+        if exporter is None:
+            # Один канал выгружается в одном задании: параллельность задаёт очередь
+            exporter = DiscordExporter(quiet=True, max_concurrency=1, **self.exporter_options, **options)
+            # Каждый экспортер перезаписывает manifest.json целиком - у одного каталога он должен быть один
+            exporter.manifest = self.manifests.setdefault(exporter.output_dir.resolve(), exporter.manifest)
+            if self.base is None:
+                self.base = exporter
+                exporter.metrics.add_hook(self._on_metrics)
+            else:
+                await exporter.share_session(self.base)
+            self.exporters[key] = exporter
+        return exporter
+
+    def _on_metrics(self, event: str, data: Dict[str, Any]):
+        if event != 'page':
+            return
+        for progress in self.running.values():
+            if progress['channel_id'] == data['channel_id']:
+                progress['messages'] += data['messages']
+
+    async def _expand(self, job_id: int, job: Dict[str, Any], target: str, target_id: int) -> int:
+        """Сервер или категория -> задания текстовых каналов"""
+        exporter = await self._exporter(job)
+        if target == 'category':
+            category = await exporter.get_channel(target_id)
+            if category.get('type') != 4:
+                raise ValueError(f"Channel {target_id} is not a category")
+            channels = await exporter.get_guild_channels(int(category['guild_id']))
+            channels = [channel for channel in channels if channel.get('parent_id') == str(target_id)]
+        else:
+            channels = await exporter.get_guild_channels(target_id)
+        added = 0
+        child = {key: value for key, value in job.items() if key not in TARGETS}
+        for channel in channels:
+            if channel.get('type') in TEXT_CHANNEL_TYPES:
+                size = DiscordExporter._estimate_channel_size(channel)
+                if self.queue.add(dict(child, channel=int(channel['id'])), parent_id=job_id, size=size) is not None:
+                    added += 1
+        return added
+
+    async def _run_job(self, job_id: int, job: Dict[str, Any]):
+        target, target_id = job_target(job)
+        started = time.perf_counter()
+        try:
+            if target != 'channel':
+                added = await self._expand(job_id, job, target, target_id)
+                self.queue.finish(job_id, None, 'expanded')
+                print(f"[{job_id}] {target} {target_id}: в очередь добавлено {added} каналов")
+                return
+            exporter = await self._exporter(job)
+            self.running[job_id] = {'channel_id': str(target_id), 'messages': 0, 'started': started}
+            print(f"[{job_id}] канал {target_id}: начат")
+            count = await exporter.export_channel(
+                target_id, limit=job.get('limit'), before=parse_date_snowflake(job.get('to') or '', end_of_day=True),
+                after=parse_date_snowflake(job.get('from') or ''), slices=job.get('slices') or 1)
+            if count is None:
+                raise ValueError(f"Unsupported output format: {job.get('format')}")
+            self.queue.finish(job_id, count)
+            self.done += 1
+            print(f"[{job_id}] канал {target_id}: готово, {count or 0} сообщений за {time.perf_counter() - started:.1f} с")
+        except Exception as e:
+            retry = self.queue.fail(job_id, str(e))
+            if not retry:
+                self.failed += 1
+            print(f"[{job_id}] {target} {target_id}: ошибка: {e}" + (" - задание вернётся в очередь" if retry else ""))
+        finally:
+            self.running.pop(job_id, None)
+
+    async def _worker(self):
+        while True:
+            claimed = self.queue.claim()
+            if claimed is None:
+                # Очередь пуста, но раскрытие сервера в другом воркере может добавить каналы
+                if not self.expanding:
+                    return
+                await asyncio.sleep(0.1)
+                continue
+            job_id, job = claimed
+            expanding = job_target(job)[0] != 'channel'
+            self.expanding += expanding
+            try:
+                await self._run_job(job_id, job)
+            finally:
+                self.expanding -= expanding
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            counts = self.queue.counts()
+            running = ', '.join(f"[{job_id}] {progress['channel_id']}: {progress['messages']} сообщ."
+                                for job_id, progress in self.running.items())
+            print(f"Очередь: ждут {counts.get('queued', 0)}, выполняются {len(self.running)}, "
+                  f"готово {self.done}, ошибок {self.failed}" + (f" | {running}" if running else ""))
+
+    async def run(self) -> Dict[str, int]:
+        recovered = self.queue.recover()
+        if recovered:
+            print(f"Возвращено в очередь прерванных заданий: {recovered}")
+        reporter = asyncio.create_task(self._report())
+        try:
+            await asyncio.gather(*(self._worker() for _ in range(self.concurrency)))
+        finally:
+            reporter.cancel()
+            await asyncio.gather(reporter, return_exceptions=True)
+            # Владелец сессии закрывается последним
+            for exporter in reversed(list(self.exporters.values())):
+                await exporter.close()
+        print(f"Очередь выполнена: готово {self.done}, ошибок {self.failed}")
+        return {'done': self.done, 'failed': self.failed}
+
+def cli_jobs(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """Задания из аргументов add: по одному на каждый указанный ID с общими параметрами"""
+    options = {}
+    for field in ('format', 'output_dir', 'compression', 'limit', 'slices', 'priority'):
+        if getattr(args, field) is not None:
+            options[field] = getattr(args, field)
+    if args.date_from:
+        options['from'] = args.date_from
+    if args.date_to:
+        options['to'] = args.date_to
+    if args.normalized:
+        options['normalized'] = True
+    return [dict(options, **{target: target_id}) for target in TARGETS for target_id in getattr(args, target) or ()]
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Пакетная выгрузка Discord по очереди заданий")
+    parser.add_argument('--db', default='exports/jobs.db', help="файл очереди SQLite")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    add = commands.add_parser('add', help="добавить задания в очередь")
+    add.add_argument('specs', nargs='*', help="файлы заданий JSON/YAML")
+    for target in TARGETS:
+        add.add_argument(f'--{target}', type=int, action='append', help=f"ID: {target}; можно повторять")
+    add.add_argument('--format', help="форматы через запятую")
+    add.add_argument('--output-dir')
+    add.add_argument('--compression', choices=['gzip', 'zstd'])
+    add.add_argument('--from', dest='date_from', help="с даты YYYY-MM-DD")
+    add.add_argument('--to', dest='date_to', help="по дату YYYY-MM-DD включительно")
+    add.add_argument('--limit', type=int)
+    add.add_argument('--slices', type=int, help="параллельных срезов по времени в одном канале")
+    add.add_argument('--normalized', action='store_true')
+    add.add_argument('--priority', type=int, help="больше - раньше")
+
+    run = commands.add_parser('run', help="выполнить очередь")
+    run.add_argument('specs', nargs='*', help="файлы заданий, которые добавить перед запуском")
+    run.add_argument('--concurrency', type=int, default=MAX_CONCURRENT_CHANNELS, help="заданий одновременно")
+    run.add_argument('--progress', type=float, default=PROGRESS_INTERVAL, help="секунд между строками прогресса")
+
+    status = commands.add_parser('status', help="состояние очереди")
+    status.add_argument('--status', dest='filter', help="только задания с этим статусом")
+    status.add_argument('--json', action='store_true')
+    return parser.parse_args(argv)
+
+def add_jobs(queue: JobQueue, jobs: List[Dict[str, Any]]) -> int:
+    """Добавление заданий: сначала проверяются все, поэтому ошибка не оставляет очередь заполненной наполовину"""
+    for job in jobs:
+        validate_job(job)
+    return sum(queue.add(job) is not None for job in jobs)
+
+def add_specs(queue: JobQueue, paths: List[str], jobs: Optional[List[Dict[str, Any]]] = None) -> int:
+    """Задания из файлов и дополнительные jobs; ValueError/OSError - ничего не добавлено"""
+    return add_jobs(queue, [job for path in paths for job in load_spec(path)] + (jobs or []))
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from dotenv import load_dotenv
+    load_dotenv()
+    args = parse_args(argv)
+    queue = JobQueue(args.db)
+    try:
+        if args.command == 'add' or (args.command == 'run' and args.specs):
+            try:
+                added = add_specs(queue, args.specs, cli_jobs(args) if args.command == 'add' else [])
+            except (OSError, ValueError) as e:
+                print(f"Ошибка в заданиях, ничего не добавлено: {e}")
+                return 2
+            print(f"Добавлено заданий: {added}")
+        if args.command == 'add':
+            return 0
+        if args.command == 'run':
+            result = asyncio.run(JobRunner(queue, args.concurrency, args.progress).run())
+            return 1 if result['failed'] else 0
+
+        jobs = queue.jobs(args.filter)
+        if args.json:
+            print(json.dumps(jobs, ensure_ascii=False, indent=2))
+        else:
+            for job in jobs:
+                target, target_id = job_target(job['spec'])
+                print(f"[{job['id']}] {job['status']:8} приоритет {job['priority']:3} {target} {target_id}"
+                      + (f", {job['messages']} сообщений" if job['messages'] is not None else "")
+                      + (f", {job['seconds']} с" if job['seconds'] is not None else "")
+                      + (f", ошибка: {job['error']}" if job['error'] else ""))
+            print(', '.join(f"{status}: {count}" for status, count in sorted(queue.counts().items())))
+        return 0
+    finally:
+        queue.close()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,200 @@
+"""Слияние пересекающихся выгрузок одного канала в один экспорт.
+
+Повторные запуски export_channel оставляют несколько файлов
+channel_<id>_<время>.json с общими сообщениями. Инструмент читает их
+потоково (в том числе JSON Lines, сжатые файлы и индексы частей), сливает
+k-путевым слиянием по snowflake ID, оставляет одну - самую свежую
+отредактированную - версию каждого сообщения и пишет результат в любом
+формате экспортера:
+
+    python discord_merge.py exports/channel_123_* --format json,html --output-dir exports/merged
+
+Служебные файлы (таблицы, индексы HTML-страниц) и части, чей индекс тоже
+передан, отбрасываются, поэтому glob можно давать по всем файлам канала.
+
+Память не зависит от объёма входных файлов: из каждого в памяти только
+текущее сообщение и страница вывода.
+"""
+import sys
+import heapq
+import asyncio
+import argparse
+from pathlib import Path
+from typing import Optional, List, Dict, Any, Iterator, Tuple, AsyncIterator
+from discord_models import Message, AuthorCache
+from discord_output import read_messages, read_tables, tables_path, export_files, COMPRESSION_EXTENSIONS
+from discord_cache import MetadataCache
+from discord_exporter import DiscordExporter
+
+PAGE_SIZE = 100  # сообщений в странице, которую получают писатели форматов
+
+# Элемент слияния: ID сообщения, номер входного файла, словарь сообщения
+MergeItem = Tuple[int, int, Dict[str, Any]]
+
+def _denormalize(message: Dict[str, Any], authors: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Авторы и упоминания нормализованного экспорта обратно в сообщение"""
+    message = dict(message)
+    author_id = message.pop('author_id', None)
+    mention_ids = message.pop('mention_ids', None) or ()
+    if author_id is not None:
+        message['author'] = authors.get(author_id) or {'id': author_id}
+    message['mentions'] = [authors.get(user_id) or {'id': user_id} for user_id in mention_ids]
+    return message
+
+def iter_export(path: Path, order: int = 0) -> Iterator[MergeItem]:
+    """Сообщения файла экспорта от новых к старым, как их пишет экспортер"""
+    tables = read_tables(path)
+    previous_id = None
+    for message in read_messages(path):
+        message_id = int(message['id'])
+        if previous_id is not None and message_id > previous_id:
+            raise ValueError(f"Export is not ordered newest first: {path}")
+        previous_id = message_id
+        if tables is not None:
+            message = _denormalize(message, tables['authors'])
+        yield message_id, order, message
+
+class MergeStats:
+    __slots__ = ('read', 'duplicates', 'edited')
+
+    def __init__(self):
+        self.read = 0
+        self.duplicates = 0  # отброшенных повторов
+        self.edited = 0  # сообщений, у которых взята более поздняя правка
+
+def _newest(versions: List[MergeItem]) -> Dict[str, Any]:
+    """Самая поздняя правка; при равных - версия из более позднего входного файла"""
+    return max(versions, key=lambda item: (item[2].get('edited_timestamp') or '', item[1]))[2]
+
+def merge_exports(paths: List[Path], stats: Optional[MergeStats] = None) -> Iterator[Dict[str, Any]]:
+    """k-путевое слияние экспортов одного канала: сообщения от новых к старым без повторов.
+
+    Каждый вход уже упорядочен по убыванию ID, поэтому heapq.merge держит в
+    памяти по одному сообщению из файла. Версии одного сообщения идут
+    подряд и сводятся к самой поздней правке.
+    """
+    stats = stats if stats is not None else MergeStats()
+    streams = [iter_export(Path(path), order) for order, path in enumerate(paths)]
+    versions: List[MergeItem] = []
+    channel_id = None
+    for item in heapq.merge(*streams, key=lambda item: item[0], reverse=True):
+        stats.read += 1
+        message_channel_id = item[2].get('channel_id')
+        if channel_id is None:
+            channel_id = message_channel_id
+        elif message_channel_id is not None and message_channel_id != channel_id:
+            raise ValueError(f"Exports belong to different channels: {channel_id} and {message_channel_id}")
+        if versions and versions[0][0] != item[0]:
+            yield _merged(versions, stats)
+            versions = []
+        versions.append(item)
+    if versions:
+        yield _merged(versions, stats)
+
+def _merged(versions: List[MergeItem], stats: MergeStats) -> Dict[str, Any]:
+    stats.duplicates += len(versions) - 1
+    message = _newest(versions)
+    if any(item[2].get('edited_timestamp') != message.get('edited_timestamp') for item in versions):
+        stats.edited += 1
+    return message
+
+def prime_metadata(paths: List[Path], cache: MetadataCache):
+    """Каналы и роли из таблиц нормализованных входов - в кэш метаданных, чтобы не запрашивать их у API.
+
+    Запись получает время изменения файла таблиц, так что устаревшие по TTL
+    данные всё равно будут запрошены заново.
+    """
+    for path in paths:
+        data = read_tables(Path(path))
+        if data is None:
+            continue
+        stored = tables_path(Path(path)).stat().st_mtime
+        guild_ids = set()
+        for channel_id, channel in data.get('channels', {}).items():
+            if len(channel) > 1 and cache.get(f'channel:{channel_id}') is None:  # {'id': ...} - данных не было
+                cache.put(f'channel:{channel_id}', channel, stored)
+            if channel.get('guild_id'):
+                guild_ids.add(channel['guild_id'])
+        roles = [role for role in data.get('roles', {}).values() if len(role) > 1]
+        if roles and len(guild_ids) == 1:
+            guild_id, = guild_ids
+            if cache.get(f'guild_roles:{guild_id}') is None:
+                cache.put(f'guild_roles:{guild_id}', roles, stored)
+
+async def merged_pages(messages: Iterator[Dict[str, Any]], page_size: int = PAGE_SIZE) -> AsyncIterator[List[Message]]:
+    """Страницы компактных сообщений для писателей экспортера; исходный словарь сохраняется в raw"""
+    authors = AuthorCache()
+    page: List[Message] = []
+    for message in messages:
+        page.append(Message.from_api(message, authors, keep_raw=True))
+        if len(page) >= page_size:
+            yield page
+            page = []
+    if page:
+        yield page
+
+def _channel_id(paths: List[Path]) -> int:
+    for path in paths:
+        for _, _, message in iter_export(Path(path)):
+            return int(message['channel_id'])
+    raise ValueError("Nothing to merge: all exports are empty")
+
+async def merge(paths: List[Path], exporter: DiscordExporter) -> Tuple[Optional[int], MergeStats]:
+    """Слияние paths и запись через exporter во все его форматы"""
+    channel_id = _channel_id(paths)
+    prime_metadata(paths, exporter.metadata)
+    stats = MergeStats()
+    count = await exporter.export_pages(channel_id, merged_pages(merge_exports(paths, stats)))
+    return count, stats
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Слияние пересекающихся выгрузок канала Discord")
+    parser.add_argument('files', nargs='+', help="JSON/JSON Lines (в том числе .gz/.zst) или *.index.json одного канала")
+    parser.add_argument('--format', default='json', help="формат вывода, несколько через запятую: json,jsonl,html,txt,csv,parquet")
+    parser.add_argument('--output-dir', default='exports/merged')
+    parser.add_argument('--compression', choices=[name for name in COMPRESSION_EXTENSIONS if name])
+    parser.add_argument('--shard-messages', type=int, help="сообщений в одной части файла")
+    parser.add_argument('--html-page-size', type=int, help="сообщений на одну HTML-страницу")
+    parser.add_argument('--normalized', action='store_true', help="авторы, роли и каналы - в отдельные таблицы")
+    parser.add_argument('--compact', action='store_true', help="JSON без отступов")
+    return parser.parse_args(argv)
+
+async def run(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    paths = export_files(args.files)
+    if len(paths) < len(args.files):
+        print(f"Пропущено служебных файлов и частей, уже входящих в индексы: {len(args.files) - len(paths)}")
+    # Сеть нужна только для недостающих ролей и каналов нормализованных таблиц,
+    # поэтому сессия не открывается заранее и без токена слияние тоже работает
+    try:
+        exporter = DiscordExporter(output_format=args.format, output_dir=args.output_dir, incremental=False,
+                                   compression=args.compression, shard_messages=args.shard_messages,
+                                   html_page_size=args.html_page_size, normalized=args.normalized,
+                                   json_indent=None if args.compact else 2, quiet=True)
+    except ValueError as e:
+        print(f"Ошибка слияния: {e}")
+        return 1
+    try:
+        try:
+            count, stats = await merge(paths, exporter)
+        except (OSError, ValueError) as e:
+            print(f"Ошибка слияния: {e}")
+            return 1
+        if count is None:
+            return 1
+        print(f"Прочитано {stats.read} сообщений из {len(paths)} файлов, дублей отброшено {stats.duplicates}, "
+              f"взято более поздних правок {stats.edited}")
+        print(f"Записано {count} сообщений:")
+        for path in exporter.exported_files:
+            print(f"  {path}")
+    finally:
+        await exporter.close()
+    return 0
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from dotenv import load_dotenv
+    load_dotenv()
+    return asyncio.run(run(argv))
+
+if __name__ == '__main__':
+    sys.exit(main())
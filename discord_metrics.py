@@ -0,0 +1,140 @@
+import json
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional, List, Dict, Any, Callable, AsyncIterator, Union
+
+# Верхние границы корзин гистограммы задержек запросов, секунды
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+MetricsHook = Callable[[str, Dict[str, Any]], None]
+
+class ExportMetrics:
+    """Метрики выгрузки вместо текстового прогресса.
+
+    Собирает гистограмму задержек запросов, счётчики HTTP-статусов, время
+    ожидания лимитов, страницы/сообщения/байты по каналам и время рендера и
+    записи по форматам, а также работу стадий конвейера выгрузки. Каждое событие дополнительно передаётся хукам
+    hook(event, data), сводка выгружается в JSON через summary()/write_summary().
+    """
+
+    def __init__(self, hooks: Optional[List[MetricsHook]] = None):
+        self.hooks: List[MetricsHook] = list(hooks or [])
+        self.started_at = datetime.now(timezone.utc)
+        self.started = time.perf_counter()
+        self.latency_buckets = [0] * len(LATENCY_BUCKETS)
+        self.latency_sum = 0.0
+        self.requests = 0
+        self.statuses: Counter = Counter()
+        self.rate_limit_wait = 0.0
+        self.rate_limited = 0
+        self.channels: Dict[str, Dict[str, Any]] = {}
+        self.formats: Dict[str, Dict[str, Any]] = {}
+        self.stages: Dict[str, Dict[str, Any]] = {}
+
+    def add_hook(self, hook: MetricsHook):
+        self.hooks.append(hook)
+
+    def _emit(self, event: str, data: Dict[str, Any]):
+        for hook in self.hooks:
+            hook(event, data)
+
+    def _channel(self, channel_id: Union[int, str]) -> Dict[str, Any]:
+        return self.channels.setdefault(str(channel_id), {'pages': 0, 'messages': 0, 'bytes': 0, 'files': 0})
+
+    def record_request(self, route: str, status: int, latency: float):
+        self.requests += 1
+        self.statuses[status] += 1
+        self.latency_sum += latency
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                self.latency_buckets[index] += 1
+                break
+        self._emit('request', {'route': route, 'status': status, 'latency': latency})
+
+    def record_rate_limit_wait(self, route: str, seconds: float):
+        if seconds <= 0:
+            return
+        self.rate_limit_wait += seconds
+        self._emit('rate_limit_wait', {'route': route, 'seconds': seconds})
+
+    def record_rate_limited(self, route: str, retry_after: float, is_global: bool):
+        self.rate_limited += 1
+        self._emit('rate_limited', {'route': route, 'retry_after': retry_after, 'global': is_global})
+
+    def record_page(self, channel_id: Union[int, str], messages: int):
+        channel = self._channel(channel_id)
+        channel['pages'] += 1
+        channel['messages'] += messages
+        self._emit('page', {'channel_id': str(channel_id), 'messages': messages, 'total': channel['messages']})
+
+    def record_output(self, channel_id: Union[int, str], output_format: str, path: Path):
+        size = path.stat().st_size
+        channel = self._channel(channel_id)
+        channel['bytes'] += size
+        channel['files'] += 1
+        self._format(output_format)['bytes'] += size
+        self._emit('output', {'channel_id': str(channel_id), 'format': output_format, 'path': str(path), 'bytes': size})
+
+    def record_pipeline(self, channel_id: Union[int, str], stages: Dict[str, Dict[str, Any]]):
+        """Сводка стадий конвейера одного канала (ExportPipeline.stats())"""
+        for name, stats in stages.items():
+            total = self.stages.setdefault(name, {'pages': 0, 'messages': 0, 'busy_seconds': 0.0,
+                                                  'idle_seconds': 0.0, 'blocked_seconds': 0.0})
+            for key in total:
+                total[key] += stats[key]
+        self._emit('pipeline', {'channel_id': str(channel_id), 'stages': stages})
+
+    def _format(self, output_format: str) -> Dict[str, Any]:
+        return self.formats.setdefault(output_format, {'messages': 0, 'seconds': 0.0, 'bytes': 0})
+
+    async def timed_pages(self, pages: AsyncIterator[List[Dict]], output_format: str) -> AsyncIterator[List[Dict]]:
+        """Учёт времени, которое писатель формата тратит на каждую страницу"""
+        stats = self._format(output_format)
+        async for page in pages:
+            started = time.perf_counter()
+            yield page
+            stats['seconds'] += time.perf_counter() - started
+            stats['messages'] += len(page)
+
+    def summary(self) -> Dict[str, Any]:
+        elapsed = time.perf_counter() - self.started
+        messages = sum(channel['messages'] for channel in self.channels.values())
+        return {
+            'started_at': self.started_at.isoformat(),
+            'elapsed_seconds': round(elapsed, 3),
+            'messages': messages,
+            'messages_per_second': round(messages / elapsed, 1) if elapsed else None,
+            'requests': {
+                'count': self.requests,
+                'statuses': {str(status): count for status, count in sorted(self.statuses.items())},
+                'latency_seconds': {
+                    'sum': round(self.latency_sum, 3),
+                    'mean': round(self.latency_sum / self.requests, 4) if self.requests else None,
+                    'histogram': {('+Inf' if bound == float('inf') else str(bound)): count
+                                  for bound, count in zip(LATENCY_BUCKETS, self.latency_buckets)},
+                },
+            },
+            'rate_limit': {
+                'wait_seconds': round(self.rate_limit_wait, 3),
+                'responses_429': self.rate_limited,
+            },
+            'channels': self.channels,
+            'formats': {name: dict(stats, seconds=round(stats['seconds'], 3)) for name, stats in self.formats.items()},
+            'stages': {
+                name: {
+                    'pages': stats['pages'],
+                    'messages': stats['messages'],
+                    'busy_seconds': round(stats['busy_seconds'], 3),
+                    'idle_seconds': round(stats['idle_seconds'], 3),
+                    'blocked_seconds': round(stats['blocked_seconds'], 3),
+                    'messages_per_second': round(stats['messages'] / stats['busy_seconds'], 1) if stats['busy_seconds'] else None,
+                }
+                for name, stats in self.stages.items()
+            },
+        }
+
+    def write_summary(self, path: Union[str, Path]):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, ensure_ascii=False, indent=2)
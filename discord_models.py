@@ -0,0 +1,230 @@
+from typing import Optional, List, Dict, Any, Tuple
+
+class Author:
+    """Автор сообщения. Экземпляры общие для всех сообщений одного пользователя"""
+    __slots__ = ('id', 'username', 'global_name', 'discriminator', 'avatar', 'bot')
+
+    def __init__(self, id: int, username: Optional[str], global_name: Optional[str] = None,
+                 discriminator: Optional[str] = None, avatar: Optional[str] = None, bot: bool = False):
+        self.id = id
+        self.username = username
+        self.global_name = global_name
+        self.discriminator = discriminator
+        self.avatar = avatar
+        self.bot = bot
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'id': str(self.id), 'username': self.username, 'global_name': self.global_name,
+            'discriminator': self.discriminator, 'avatar': self.avatar, 'bot': self.bot,
+        }
+
+class AuthorCache:
+    """Интернирование авторов: одинаковые данные пользователя - один объект"""
+
+    def __init__(self):
+        self.authors: Dict[Tuple, Author] = {}
+
+    def get(self, data: Optional[Dict[str, Any]]) -> Optional[Author]:
+        if not data or data.get('id') in (None, ''):
+            return None
+        key = (data['id'], data.get('username'), data.get('global_name'), data.get('discriminator'),
+               data.get('avatar'), bool(data.get('bot')))
+        author = self.authors.get(key)
+        if author is None:
+            author = self.authors[key] = Author(int(key[0]), *key[1:])
+        return author
+
+class Attachment:
+    __slots__ = ('id', 'filename', 'url', 'proxy_url', 'size', 'content_type', 'local_path')
+
+    def __init__(self, id: int, filename: Optional[str], url: Optional[str], proxy_url: Optional[str] = None,
+                 size: Optional[int] = None, content_type: Optional[str] = None, local_path: Optional[str] = None):
+        self.id = id
+        self.filename = filename
+        self.url = url
+        self.proxy_url = proxy_url
+        self.size = size
+        self.content_type = content_type
+        self.local_path = local_path  # путь к загруженной копии относительно output_dir
+
+    @classmethod
+    def from_api(cls, data: Dict[str, Any]) -> 'Attachment':
+        return cls(int(data['id']), data.get('filename'), data.get('url'), data.get('proxy_url'),
+                   data.get('size'), data.get('content_type'), data.get('local_path'))
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {
+            'id': str(self.id), 'filename': self.filename, 'url': self.url, 'proxy_url': self.proxy_url,
+            'size': self.size, 'content_type': self.content_type,
+        }
+        if self.local_path:
+            data['local_path'] = self.local_path
+        return data
+
+class Reaction:
+    __slots__ = ('emoji_id', 'emoji_name', 'count')
+
+    def __init__(self, emoji_id: Optional[int], emoji_name: Optional[str], count: int):
+        self.emoji_id = emoji_id
+        self.emoji_name = emoji_name
+        self.count = count
+
+    @classmethod
+    def from_api(cls, data: Dict[str, Any]) -> 'Reaction':
+        emoji = data.get('emoji') or {}
+        return cls(int(emoji['id']) if emoji.get('id') else None, emoji.get('name'), data.get('count', 0))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'emoji': {'id': str(self.emoji_id) if self.emoji_id else None, 'name': self.emoji_name}, 'count': self.count}
+
+# Поля эмбеда, которые используют форматы экспорта
+EMBED_FIELDS = ('type', 'title', 'description', 'url')
+
+class Message:
+    """Компактное сообщение: только поля, которые читают форматы экспорта.
+
+    Строится из ответа API при декодировании страницы; полный словарь API
+    сохраняется в raw, только если экспортер создан с raw=True.
+    """
+    __slots__ = ('id', 'channel_id', 'type', 'author', 'content', 'timestamp', 'edited_timestamp', 'pinned',
+                 'attachments', 'embeds', 'reactions', 'mentions', 'mention_roles',
+                 'reference_message_id', 'reference_channel_id', 'raw')
+
+    def __init__(self, id: int, channel_id: int, type: int = 0, author: Optional[Author] = None,
+                 content: str = '', timestamp: Optional[str] = None, edited_timestamp: Optional[str] = None,
+                 pinned: bool = False, attachments: Tuple[Attachment, ...] = (), embeds: Tuple[Dict, ...] = (),
+                 reactions: Tuple[Reaction, ...] = (), mentions: Tuple[Author, ...] = (),
+                 mention_roles: Tuple[int, ...] = (), reference_message_id: Optional[int] = None,
+                 reference_channel_id: Optional[int] = None, raw: Optional[Dict[str, Any]] = None):
+        self.id = id
+        self.channel_id = channel_id
+        self.type = type
+        self.author = author
+        self.content = content
+        self.timestamp = timestamp
+        self.edited_timestamp = edited_timestamp
+        self.pinned = pinned
+        self.attachments = attachments
+        self.embeds = embeds
+        self.reactions = reactions
+        self.mentions = mentions
+        self.mention_roles = mention_roles
+        self.reference_message_id = reference_message_id
+        self.reference_channel_id = reference_channel_id
+        self.raw = raw
+
+    @classmethod
+    def from_api(cls, data: Dict[str, Any], authors: AuthorCache, keep_raw: bool = False) -> 'Message':
+        reference = data.get('message_reference') or {}
+        return cls(
+            int(data['id']),
+            int(data['channel_id']),
+            data.get('type', 0),
+            authors.get(data.get('author')),
+            data.get('content') or '',
+            data.get('timestamp'),
+            data.get('edited_timestamp'),
+            bool(data.get('pinned')),
+            tuple(Attachment.from_api(attachment) for attachment in data.get('attachments') or ()),
+            tuple({key: embed[key] for key in EMBED_FIELDS if embed.get(key)} for embed in data.get('embeds') or ()),
+            tuple(Reaction.from_api(reaction) for reaction in data.get('reactions') or ()),
+            tuple(authors.get(user) for user in data.get('mentions') or () if user.get('id')),
+            tuple(int(role_id) for role_id in data.get('mention_roles') or ()),
+            int(reference['message_id']) if reference.get('message_id') else None,
+            int(reference['channel_id']) if reference.get('channel_id') else None,
+            data if keep_raw else None,
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Словарь в форме ответа API, только с сохранёнными полями"""
+        data = {
+            'id': str(self.id),
+            'channel_id': str(self.channel_id),
+            'type': self.type,
+            'author': self.author.to_dict() if self.author else None,
+            'content': self.content,
+            'timestamp': self.timestamp,
+            'edited_timestamp': self.edited_timestamp,
+            'pinned': self.pinned,
+            'attachments': [attachment.to_dict() for attachment in self.attachments],
+            'embeds': list(self.embeds),
+            'reactions': [reaction.to_dict() for reaction in self.reactions],
+            'mentions': [author.to_dict() for author in self.mentions],
+            'mention_roles': [str(role_id) for role_id in self.mention_roles],
+        }
+        if self.reference_message_id:
+            data['message_reference'] = {
+                'message_id': str(self.reference_message_id),
+                'channel_id': str(self.reference_channel_id) if self.reference_channel_id else None,
+            }
+        return data
+
+    def export_dict(self, normalized: bool = False) -> Dict[str, Any]:
+        """Словарь для JSON-форматов: полный ответ API в режиме raw, иначе компактный.
+
+        normalized=True заменяет объекты авторов на author_id/mention_ids -
+        сами авторы пишутся один раз в таблицы LookupTables.
+        """
+        if self.raw is None:
+            data = self.to_dict()
+        elif any(attachment.local_path for attachment in self.attachments):
+            data = dict(self.raw)
+            local_paths = {str(attachment.id): attachment.local_path for attachment in self.attachments}
+            data['attachments'] = [dict(attachment, local_path=local_paths.get(attachment['id']))
+                                   for attachment in self.raw.get('attachments') or ()]
+        else:
+            data = self.raw
+        if not normalized:
+            return data
+        data = dict(data)
+        author = data.pop('author', None)
+        data['author_id'] = author['id'] if author else None
+        data['mention_ids'] = [user['id'] for user in data.pop('mentions', None) or ()]
+        data.pop('referenced_message', None)  # есть в message_reference
+        return data
+
+# Поля каналов и ролей в таблицах нормализованного экспорта
+CHANNEL_FIELDS = ('id', 'name', 'type', 'guild_id', 'parent_id', 'topic')
+ROLE_FIELDS = ('id', 'name', 'color', 'position')
+
+class LookupTables:
+    """Таблицы нормализованного экспорта: авторы, роли и каналы по ID.
+
+    Собираются по мере записи сообщений; у авторов остаётся первая (самая
+    новая) версия. Роли и каналы известны только по ID, их данные экспортер
+    дозапрашивает перед записью таблиц (None - данных нет).
+    """
+
+    def __init__(self):
+        self.authors: Dict[str, Dict[str, Any]] = {}
+        self.roles: Dict[str, Optional[Dict[str, Any]]] = {}
+        self.channels: Dict[str, Optional[Dict[str, Any]]] = {}
+
+    def add(self, message: Message):
+        if message.raw is not None:
+            users = [message.raw.get('author'), *(message.raw.get('mentions') or ())]
+        else:
+            users = [author.to_dict() for author in (message.author, *message.mentions) if author is not None]
+        for user in users:
+            if user and user.get('id') is not None and user['id'] not in self.authors:
+                self.authors[user['id']] = user
+        for role_id in message.mention_roles:
+            self.roles.setdefault(str(role_id), None)
+        self.channels.setdefault(str(message.channel_id), None)
+        if message.reference_channel_id:
+            self.channels.setdefault(str(message.reference_channel_id), None)
+
+    def set_channel(self, data: Dict[str, Any]):
+        self.channels[str(data['id'])] = {key: data.get(key) for key in CHANNEL_FIELDS}
+
+    def set_role(self, data: Dict[str, Any]):
+        if str(data['id']) in self.roles:
+            self.roles[str(data['id'])] = {key: data.get(key) for key in ROLE_FIELDS}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'authors': self.authors,
+            'roles': {role_id: data or {'id': role_id} for role_id, data in self.roles.items()},
+            'channels': {channel_id: data or {'id': channel_id} for channel_id, data in self.channels.items()},
+        }
@@ -0,0 +1,276 @@
+import io
+import json
+import os
+from pathlib import Path
+from typing import Optional, List, Dict, Any, Callable, BinaryIO, TextIO, Iterator, Iterable, Union
+
+COMPRESSION_EXTENSIONS = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+READ_CHUNK_SIZE = 1 << 16
+JSON_EXPORT_SUFFIXES = ('.json', '.jsonl')
+# Служебные JSON-файлы каталога выгрузки, а не экспорты сообщений
+SERVICE_FILES = ('manifest.json', 'metadata_cache.json')
+
+def compressed_path(path: Path, compression: Optional[str]) -> Path:
+    return path.with_name(path.name + COMPRESSION_EXTENSIONS[compression])
+
+def result_path(path: Path, compression: Optional[str], limited: bool) -> Path:
+    """Файл, по которому находят вывод: индекс частей при нарезке, иначе сам файл"""
+    if limited:
+        return path.with_name(path.name + '.index.json')
+    return compressed_path(path, compression)
+
+def _zstandard():
+    """Модуль zstandard; импортируется только при работе со сжатием zstd"""
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError("zstd compression requires the zstandard package") from None
+    return zstandard
+
+def check_compression(compression: Optional[str]):
+    """ValueError, если сжатие неизвестно или для него не установлен модуль"""
+    if compression not in COMPRESSION_EXTENSIONS:
+        raise ValueError(f"Unsupported compression: {compression}")
+    if compression == 'zstd':
+        _zstandard()
+
+def open_compressed(path: Path, compression: Optional[str]) -> BinaryIO:
+    """Бинарный поток записи: обычный файл, gzip или zstd"""
+    if compression is None:
+        return open(path, 'wb')
+    if compression == 'gzip':
+        import gzip
+        return gzip.open(path, 'wb', compresslevel=GZIP_LEVEL)
+    if compression == 'zstd':
+        return _zstandard().ZstdCompressor(level=ZSTD_LEVEL).stream_writer(open(path, 'wb'))
+    raise ValueError(f"Unsupported compression: {compression}")
+
+class ShardedOutput:
+    """Файл экспорта одного формата: сжатие и нарезка на нумерованные части.
+
+    path - файл без суффикса сжатия (channel_1_<время>.json). Без лимитов
+    пишется один файл; с max_bytes (несжатый объём) или max_messages
+    сообщения раскладываются по частям channel_1_<время>.partNNN.json[.gz],
+    а рядом всегда пишется индекс channel_1_<время>.json.index.json с диапазонами
+    snowflake каждой части. Части меняются только между сообщениями, и
+    каждая получает свои header и footer, поэтому остаётся валидным файлом.
+
+    paged=True - части переключает сам писатель через new_part() (страницы
+    HTML): первая часть остаётся path, следующие получают суффикс _pN.
+    """
+
+    def __init__(self, path: Path, compression: Optional[str] = None,
+                 max_bytes: Optional[int] = None, max_messages: Optional[int] = None,
+                 header: str = '', footer: Callable[[int], str] = lambda count: '',
+                 on_part: Optional[Callable[[Path], None]] = None, paged: bool = False):
+        self.path = path
+        self.compression = compression
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+        self.header = header
+        self.footer = footer
+        self.on_part = on_part  # вызывается для каждой закрытой части
+        self.paged = paged
+        self.limited = bool(max_bytes or max_messages)
+        self.sharded = self.limited and not paged
+        self.parts: List[Dict[str, Any]] = []
+        self.stream: Optional[BinaryIO] = None
+        self.total = 0
+        self._open_part()
+
+    @property
+    def index_path(self) -> Path:
+        return self.path.with_name(self.path.name + '.index.json')
+
+    @property
+    def result_path(self) -> Path:
+        return result_path(self.path, self.compression, self.limited)
+
+    def part_path(self, number: int) -> Path:
+        if self.paged:
+            path = self.path if number == 1 else self.path.with_name(f'{self.path.stem}_p{number}{self.path.suffix}')
+        elif self.sharded:
+            path = self.path.with_name(f'{self.path.stem}.part{number:03d}{self.path.suffix}')
+        else:
+            path = self.path
+        return compressed_path(path, self.compression)
+
+    @property
+    def part(self) -> Dict[str, Any]:
+        return self.parts[-1]
+
+    @property
+    def full(self) -> bool:
+        part = self.part
+        return bool(part['count']) and (
+            (self.max_messages is not None and part['count'] >= self.max_messages)
+            or (self.max_bytes is not None and part['bytes'] >= self.max_bytes))
+
+    def _open_part(self):
+        path = self.part_path(len(self.parts) + 1)
+        self.parts.append({'file': path.name, 'count': 0, 'bytes': 0, 'size': 0, 'newest_id': None, 'oldest_id': None})
+        self.stream = open_compressed(path, self.compression)
+        if self.header:
+            self.write(self.header)
+
+    def _close_part(self):
+        self.write(self.footer(self.part['count']))
+        self.stream.close()
+        self.stream = None
+        path = self.path.parent / self.part['file']
+        self.part['size'] = path.stat().st_size  # на диске, после сжатия
+        if self.on_part is not None:
+            self.on_part(path)
+
+    def new_part(self):
+        self._close_part()
+        self._open_part()
+
+    def start_message(self, message_id: int) -> bool:
+        """Учёт очередного сообщения; True - оно первое в своей части"""
+        if self.sharded and self.full:
+            self.new_part()
+        part = self.part
+        if part['newest_id'] is None:
+            part['newest_id'] = str(message_id)
+        part['oldest_id'] = str(message_id)
+        part['count'] += 1
+        self.total += 1
+        return part['count'] == 1
+
+    def write(self, text: str):
+        data = text.encode('utf-8')
+        self.stream.write(data)
+        self.part['bytes'] += len(data)
+
+    def flush(self):
+        self.stream.flush()
+
+    def close(self):
+        """Закрывает последнюю часть и записывает индекс частей"""
+        if self.stream is None:
+            return
+        self._close_part()
+        if self.limited:
+            self._write_index()
+
+    def _write_index(self):
+        index = {
+            'format': self.path.suffix.lstrip('.'),
+            'compression': self.compression,
+            'messages': self.total,
+            'parts': self.parts,
+        }
+        tmp_path = self.index_path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.index_path)
+
+def open_decompressed(path: Path) -> TextIO:
+    """Текстовый поток чтения файла экспорта; сжатие определяется по суффиксу"""
+    if path.suffix == '.gz':
+        import gzip
+        return gzip.open(path, 'rt', encoding='utf-8')
+    if path.suffix == '.zst':
+        zstandard = _zstandard()
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True), encoding='utf-8')
+    return open(path, 'r', encoding='utf-8')
+
+def _iter_json_array(f: TextIO) -> Iterator[Dict[str, Any]]:
+    """Элементы JSON-массива по одному, без загрузки всего файла"""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    eof = False
+    while True:
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if not started and position < len(buffer):
+                if buffer[position] != '[':
+                    raise ValueError("Expected a JSON array")
+                started = True
+                position += 1
+                continue
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                break
+            yield item
+        buffer = buffer[position:]
+        chunk = f.read(READ_CHUNK_SIZE)
+        if not chunk:
+            if eof or not buffer.strip():
+                return
+            eof = True
+        buffer += chunk
+
+def tables_path(path: Path) -> Path:
+    """Таблицы нормализованного экспорта рядом с файлом: <имя>.json.tables.json"""
+    name = path.name
+    for suffix in ('.index.json', '.gz', '.zst'):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return path.with_name(name + '.tables.json')
+
+def read_tables(path: Path) -> Optional[Dict[str, Any]]:
+    """Таблицы нормализованного экспорта файла path; None - экспорт не нормализован"""
+    path = tables_path(Path(path))
+    if not path.exists():
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def export_files(paths: Iterable[Union[str, Path]]) -> List[Path]:
+    """Файлы выгрузок JSON/JSON Lines среди paths - например, из glob по каталогу exports.
+
+    Служебные файлы (manifest.json, кэш метаданных, таблицы нормализованного
+    экспорта, индексы частей HTML) отбрасываются, как и части, чей индекс
+    тоже есть в списке, - иначе они читались бы дважды. Отсутствующие файлы
+    остаются в списке, чтобы вызывающий сообщил об ошибке.
+    """
+    files = []
+    indexed = set()
+    for path in map(Path, paths):
+        name = path.name
+        if name in SERVICE_FILES or name.endswith('.tables.json'):
+            continue
+        if name.endswith('.index.json'):
+            if Path(name[:-len('.index.json')]).suffix not in JSON_EXPORT_SUFFIXES:
+                continue
+            if path.exists():
+                with open(path, 'r', encoding='utf-8') as f:
+                    indexed.update(path.parent / part['file'] for part in json.load(f)['parts'])
+        else:
+            data_name = name[:-len(path.suffix)] if path.suffix in ('.gz', '.zst') else name
+            if Path(data_name).suffix not in JSON_EXPORT_SUFFIXES:
+                continue
+        files.append(path)
+    return [path for path in files if path not in indexed]
+
+def read_messages(path: Path) -> Iterator[Dict[str, Any]]:
+    """Сообщения из файла экспорта JSON/JSON Lines (в том числе сжатого) или из индекса частей"""
+    path = Path(path)
+    if path.name.endswith('.index.json'):
+        with open(path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        for part in index['parts']:
+            yield from read_messages(path.parent / part['file'])
+        return
+    name = path.name[:-len(path.suffix)] if path.suffix in ('.gz', '.zst') else path.name
+    with open_decompressed(path) as f:
+        if name.endswith('.jsonl'):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        elif name.endswith('.json'):
+            yield from _iter_json_array(f)
+        else:
+            raise ValueError(f"Not a JSON export: {path}")
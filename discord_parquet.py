@@ -0,0 +1,120 @@
+"""Колоночный экспорт в Parquet через необязательный pyarrow.
+
+Каждая страница сообщений превращается в RecordBatch с типизированными
+колонками (snowflake - int64, время - timestamp UTC, вложения и реакции -
+вложенные списки структур); пакеты копятся до PARQUET_ROW_GROUP_SIZE строк
+и пишутся группой строк, так что файл растёт по мере выгрузки.
+"""
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, List
+
+try:
+    import pyarrow  # колоночный формат, если установлен
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from discord_models import Message
+
+PARQUET_ROW_GROUP_SIZE = 10000  # строк в группе: меньше - больше накладных расходов при чтении
+# Сжатие экспортера -> кодек Parquet; без сжатия - snappy, стандарт для Parquet
+PARQUET_CODECS = {None: 'snappy', 'gzip': 'gzip', 'zstd': 'zstd'}
+
+def _schema():
+    timestamp = pyarrow.timestamp('us', tz='UTC')
+    return pyarrow.schema([
+        ('id', pyarrow.int64()),
+        ('channel_id', pyarrow.int64()),
+        ('type', pyarrow.int32()),
+        ('author_id', pyarrow.int64()),
+        ('author_username', pyarrow.string()),
+        ('author_global_name', pyarrow.string()),
+        ('author_bot', pyarrow.bool_()),
+        ('content', pyarrow.string()),
+        ('timestamp', timestamp),
+        ('edited_timestamp', timestamp),
+        ('pinned', pyarrow.bool_()),
+        ('reference_message_id', pyarrow.int64()),
+        ('reference_channel_id', pyarrow.int64()),
+        ('attachments', pyarrow.list_(pyarrow.struct([
+            ('id', pyarrow.int64()),
+            ('filename', pyarrow.string()),
+            ('url', pyarrow.string()),
+            ('size', pyarrow.int64()),
+            ('content_type', pyarrow.string()),
+            ('local_path', pyarrow.string()),
+        ]))),
+        ('reactions', pyarrow.list_(pyarrow.struct([
+            ('emoji_id', pyarrow.int64()),
+            ('emoji_name', pyarrow.string()),
+            ('count', pyarrow.int32()),
+        ]))),
+        ('mention_ids', pyarrow.list_(pyarrow.int64())),
+        ('mention_role_ids', pyarrow.list_(pyarrow.int64())),
+        ('embed_count', pyarrow.int32()),
+    ])
+
+def _timestamp(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+def record_batch(messages: List[Message]) -> 'pyarrow.RecordBatch':
+    """Страница сообщений как RecordBatch; чистая функция - её можно отдать пулу рендера"""
+    authors = [message.author for message in messages]
+    columns = {
+        'id': [message.id for message in messages],
+        'channel_id': [message.channel_id for message in messages],
+        'type': [message.type for message in messages],
+        'author_id': [author.id if author else None for author in authors],
+        'author_username': [author.username if author else None for author in authors],
+        'author_global_name': [author.global_name if author else None for author in authors],
+        'author_bot': [author.bot if author else None for author in authors],
+        'content': [message.content for message in messages],
+        'timestamp': [_timestamp(message.timestamp) for message in messages],
+        'edited_timestamp': [_timestamp(message.edited_timestamp) for message in messages],
+        'pinned': [message.pinned for message in messages],
+        'reference_message_id': [message.reference_message_id for message in messages],
+        'reference_channel_id': [message.reference_channel_id for message in messages],
+        'attachments': [[{
+            'id': attachment.id, 'filename': attachment.filename, 'url': attachment.url,
+            'size': attachment.size, 'content_type': attachment.content_type, 'local_path': attachment.local_path,
+        } for attachment in message.attachments] for message in messages],
+        'reactions': [[{
+            'emoji_id': reaction.emoji_id, 'emoji_name': reaction.emoji_name, 'count': reaction.count,
+        } for reaction in message.reactions] for message in messages],
+        'mention_ids': [[author.id for author in message.mentions] for message in messages],
+        'mention_role_ids': [list(message.mention_roles) for message in messages],
+        'embed_count': [len(message.embeds) for message in messages],
+    }
+    return pyarrow.RecordBatch.from_pydict(columns, schema=_schema())
+
+class ParquetOutput:
+    """Файл Parquet, в который страницы дописываются группами строк"""
+
+    def __init__(self, path: Path, compression: Optional[str] = None,
+                 row_group_size: int = PARQUET_ROW_GROUP_SIZE):
+        if pyarrow is None:
+            raise ValueError("Parquet export requires the pyarrow package")
+        self.path = path
+        self.row_group_size = row_group_size
+        self.writer = pyarrow.parquet.ParquetWriter(path, _schema(), compression=PARQUET_CODECS[compression])
+        self.batches: List['pyarrow.RecordBatch'] = []
+        self.buffered = 0
+        self.total = 0
+
+    def write_batch(self, batch: 'pyarrow.RecordBatch'):
+        self.batches.append(batch)
+        self.buffered += batch.num_rows
+        self.total += batch.num_rows
+        if self.buffered >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if self.batches:
+            self.writer.write_table(pyarrow.Table.from_batches(self.batches), row_group_size=self.row_group_size)
+            self.batches = []
+            self.buffered = 0
+
+    def close(self):
+        self.flush()
+        self.writer.close()
@@ -0,0 +1,166 @@
+import time
+import asyncio
+import inspect
+from typing import Optional, List, Dict, Any, Callable, AsyncIterator, Tuple
+
+PIPELINE_QUEUE_SIZE = 4  # страниц в очереди между соседними стадиями
+
+# Элемент конвейера: страница и действие, которое нужно выполнить, когда
+# страница записана (контрольная точка манифеста). Страница None - только действие.
+PipelineItem = Tuple[Optional[Any], Optional[Callable[[], None]]]
+
+class _Done:
+    """Маркер конца потока; error - исключение стадии, которое нужно поднять у писателя"""
+    __slots__ = ('error',)
+
+    def __init__(self, error: Optional[BaseException] = None):
+        self.error = error
+
+class StageStats:
+    __slots__ = ('name', 'pages', 'messages', 'busy', 'idle', 'blocked')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.pages = 0
+        self.messages = 0
+        self.busy = 0.0  # работа самой стадии
+        self.idle = 0.0  # ожидание страницы от предыдущей стадии
+        self.blocked = 0.0  # ожидание места в очереди следующей стадии
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'pages': self.pages,
+            'messages': self.messages,
+            'busy_seconds': round(self.busy, 3),
+            'idle_seconds': round(self.idle, 3),
+            'blocked_seconds': round(self.blocked, 3),
+            'messages_per_second': round(self.messages / self.busy, 1) if self.busy else None,
+        }
+
+class ExportPipeline:
+    """Стадии выгрузки канала, связанные ограниченными очередями asyncio.
+
+    Каждая стадия, кроме последней, работает в своей задаче: пока писатель
+    записывает страницу, следующая уже загружается и декодируется. Очереди
+    размером queue_size дают обратное давление - быстрая загрузка не
+    накапливает историю в памяти, если писатель не успевает.
+
+    Действия элементов (контрольные точки) выполняются в порядке страниц,
+    когда писатель запрашивает следующую страницу, то есть после записи.
+    Стадии сами считают страницы, сообщения и время работы, простоя и
+    ожидания очереди - по ним видно узкое место.
+    """
+
+    def __init__(self, queue_size: int = PIPELINE_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.stages: List[StageStats] = []
+        self.tasks: List[asyncio.Task] = []
+
+    def _stage(self, name: str) -> StageStats:
+        stats = StageStats(name)
+        self.stages.append(stats)
+        return stats
+
+    async def _put(self, queue: asyncio.Queue, item: Any, stats: StageStats):
+        started = time.perf_counter()
+        await queue.put(item)
+        stats.blocked += time.perf_counter() - started
+
+    @staticmethod
+    def _count(stats: StageStats, page: Optional[Any]):
+        if page is not None:
+            stats.pages += 1
+            stats.messages += len(page)
+
+    def source(self, name: str, items: AsyncIterator[PipelineItem]) -> asyncio.Queue:
+        """Первая стадия: элементы асинхронного генератора в очередь"""
+        stats = self._stage(name)
+        output: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+
+        async def run():
+            try:
+                while True:
+                    started = time.perf_counter()
+                    try:
+                        item = await items.__anext__()
+                    except StopAsyncIteration:
+                        break
+                    finally:
+                        stats.busy += time.perf_counter() - started
+                    self._count(stats, item[0])
+                    await self._put(output, item, stats)
+            except Exception as e:
+                await output.put(_Done(e))
+            else:
+                await output.put(_Done())
+
+        self.tasks.append(asyncio.create_task(run()))
+        return output
+
+    def map(self, name: str, queue: asyncio.Queue, func: Callable[[Any], Any]) -> asyncio.Queue:
+        """Промежуточная стадия: func (обычная или async) над каждой страницей"""
+        stats = self._stage(name)
+        output: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        is_async = inspect.iscoroutinefunction(func)
+
+        async def run():
+            while True:
+                started = time.perf_counter()
+                item = await queue.get()
+                stats.idle += time.perf_counter() - started
+                if isinstance(item, _Done):
+                    await output.put(item)
+                    return
+                page, action = item
+                if page is not None:
+                    started = time.perf_counter()
+                    try:
+                        page = await func(page) if is_async else func(page)
+                    except Exception as e:
+                        await output.put(_Done(e))
+                        return
+                    finally:
+                        stats.busy += time.perf_counter() - started
+                    self._count(stats, page)
+                await self._put(output, (page, action), stats)
+
+        self.tasks.append(asyncio.create_task(run()))
+        return output
+
+    async def sink(self, name: str, queue: asyncio.Queue) -> AsyncIterator[Any]:
+        """Последняя стадия: страницы для писателя формата в текущей задаче"""
+        stats = self._stage(name)
+        try:
+            while True:
+                started = time.perf_counter()
+                item = await queue.get()
+                stats.idle += time.perf_counter() - started
+                if isinstance(item, _Done):
+                    if item.error is not None:
+                        raise item.error
+                    return
+                page, action = item
+                if page is not None:
+                    started = time.perf_counter()
+                    yield page
+                    stats.busy += time.perf_counter() - started
+                    self._count(stats, page)
+                # Писатель запросил следующую страницу - предыдущая записана
+                if action is not None:
+                    action()
+        finally:
+            for task in self.tasks:
+                task.cancel()
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {stage.name: stage.to_dict() for stage in self.stages}
+
+    def bottleneck(self) -> Optional[str]:
+        """Стадия, дольше всех занятая собственной работой"""
+        return max(self.stages, key=lambda stage: stage.busy).name if self.stages else None
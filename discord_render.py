@@ -0,0 +1,186 @@
+"""Рендер сообщений в текст форматов экспорта.
+
+Функции RENDERERS получают страницу компактных записей и возвращают текст
+каждого сообщения. Они не зависят от экспортера и его состояния, поэтому
+DiscordExporter может выполнять их в пуле потоков или процессов, а в цикле
+событий остаётся только запись готового текста.
+
+Зависимости отдельных форматов (jinja2 для HTML, csv, orjson для JSON)
+импортируются при первом рендере этого формата.
+"""
+import io
+import json
+from functools import lru_cache
+from typing import Optional, List, Any, Callable, Dict, TYPE_CHECKING
+from discord_models import Message
+
+if TYPE_CHECKING:
+    from jinja2 import Template
+
+HTML_TEMPLATE = """
+        <!DOCTYPE html>
+        <html>
+        <head>
+            <meta charset="utf-8">
+            <title>Discord Chat Export - Channel {{ channel_id }}</title>
+            <style>
+                body { font-family: Arial, sans-serif; margin: 20px; background: #36393f; color: #dcddde; }
+                .message { margin-bottom: 20px; padding: 10px; border-bottom: 1px solid #2f3136; }
+                .author { font-weight: bold; color: #7289da; }
+                .timestamp { color: #72767d; font-size: 0.8em; }
+                .content { margin: 5px 0; }
+                .attachment { color: #7289da; }
+                .embed { background: #2f3136; border-left: 4px solid #7289da; padding: 10px; margin: 5px 0; }
+                .reaction { display: inline-block; margin: 0 5px; }
+                .pinned { color: #faa61a; }
+                .nav { margin: 20px 0; color: #72767d; }
+                .nav a { color: #7289da; margin: 0 10px; }
+            </style>
+        </head>
+        <body>
+            <h1>Экспорт чата: Channel {{ channel_id }}</h1>
+            {% if nav.page %}
+            <div class="nav">{% if nav.prev %}<a href="{{ nav.prev }}">← Предыдущая</a>{% endif %} Страница {{ nav.page }}</div>
+            {% endif %}
+            {% for html in messages %}{{ html }}{% endfor %}
+            {% if nav.page %}
+            <div class="nav">{% if nav.prev %}<a href="{{ nav.prev }}">← Предыдущая</a>{% endif %} Страница {{ nav.page }} {% if nav.next %}<a href="{{ nav.next }}">Следующая →</a>{% endif %}</div>
+            {% endif %}
+        </body>
+        </html>
+        """
+
+# Разметка одного сообщения; HTML_TEMPLATE вставляет готовые фрагменты
+HTML_MESSAGE_TEMPLATE = """
+{% macro render(message) %}
+            <div class="message">
+                <div class="author">{{ message.author.username }}</div>
+                <div class="timestamp">{{ message.timestamp }}</div>
+                {% if message.content %}
+                <div class="content">{{ message.content }}</div>
+                {% endif %}
+                {% if message.attachments %}
+                <div class="attachments">
+                    {% for attachment in message.attachments %}
+                    <div class="attachment">📎 <a href="{{ attachment.local_path or attachment.url }}">{{ attachment.filename }}</a>{% if attachment.local_path %} (<a href="{{ attachment.url }}">оригинал</a>){% endif %}</div>
+                    {% endfor %}
+                </div>
+                {% endif %}
+                {% if message.embeds %}
+                <div class="embeds">
+                    {% for embed in message.embeds %}
+                    <div class="embed">
+                        {% if embed.title %}
+                        <div class="embed-title">{{ embed.title }}</div>
+                        {% endif %}
+                        {% if embed.description %}
+                        <div class="embed-description">{{ embed.description }}</div>
+                        {% endif %}
+                    </div>
+                    {% endfor %}
+                </div>
+                {% endif %}
+                {% if message.reactions %}
+                <div class="reactions">
+                    {% for reaction in message.reactions %}
+                    <span class="reaction">{{ reaction.emoji_name }} {{ reaction.count }}</span>
+                    {% endfor %}
+                </div>
+                {% endif %}
+                {% if message.pinned %}
+                <div class="pinned">📌 Закреплено</div>
+                {% endif %}
+            </div>
+{% endmacro %}
+"""
+
+@lru_cache(maxsize=None)
+def html_template() -> 'Template':
+    """Шаблон HTML компилируется один раз на процесс"""
+    from jinja2 import Environment
+    return Environment(enable_async=True).from_string(HTML_TEMPLATE)
+
+@lru_cache(maxsize=None)
+def html_message_macro() -> Callable[[Message], str]:
+    from jinja2 import Environment
+    return Environment().from_string(HTML_MESSAGE_TEMPLATE).module.render
+
+@lru_cache(maxsize=None)
+def _orjson():
+    """Быстрый JSON-энкодер orjson, если установлен"""
+    try:
+        import orjson
+    except ImportError:
+        return None
+    return orjson
+
+def json_dumps(obj: Any, indent: Optional[int] = None) -> str:
+    """Сериализация одного объекта: orjson при наличии, иначе стандартный json"""
+    orjson = _orjson()
+    if orjson is not None and indent in (None, 2):
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0).decode('utf-8')
+    if indent is None:
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+    return json.dumps(obj, ensure_ascii=False, indent=indent)
+
+def render_json(messages: List[Message], indent: Optional[int] = 2, normalized: bool = False) -> List[str]:
+    """Элементы JSON-массива; отступы сдвинуты под уровень массива"""
+    separator = '\n  ' if indent else '\n'
+    texts = []
+    for message in messages:
+        text = json_dumps(message.export_dict(normalized), indent)
+        texts.append(text.replace('\n', separator) if indent else text)
+    return texts
+
+def render_jsonl(messages: List[Message], normalized: bool = False) -> List[str]:
+    return [json_dumps(message.export_dict(normalized)) + '\n' for message in messages]
+
+def render_html(messages: List[Message]) -> List[str]:
+    render = html_message_macro()
+    return [str(render(message)) for message in messages]
+
+def render_txt(messages: List[Message]) -> List[str]:
+    texts = []
+    for message in messages:
+        lines = [f"[{message.timestamp}] {message.author.username if message.author else None}:\n"]
+        if message.content:
+            lines.append(f"{message.content}\n")
+        for attachment in message.attachments:
+            lines.append(f"[Вложение: {attachment.filename}]\n")
+        if message.embeds:
+            lines.append("[Эмбеды]\n")
+        lines.append("\n")
+        texts.append(''.join(lines))
+    return texts
+
+def render_csv(messages: List[Message], normalized: bool = False) -> List[str]:
+    """Строки CSV; в нормализованном виде вместо имени автора - его ID"""
+    import csv
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    texts = []
+    for message in messages:
+        if normalized:
+            author = message.author.id if message.author else None
+        else:
+            author = message.author.username if message.author else None
+        writer.writerow([
+            message.timestamp,
+            author,
+            message.content,
+            len(message.attachments),
+            len(message.embeds),
+            len(message.reactions)
+        ])
+        texts.append(buffer.getvalue())
+        buffer.seek(0)
+        buffer.truncate()
+    return texts
+
+RENDERERS: Dict[str, Callable[..., List[str]]] = {
+    'json': render_json,
+    'jsonl': render_jsonl,
+    'html': render_html,
+    'txt': render_txt,
+    'csv': render_csv,
+}
@@ -0,0 +1,260 @@
+"""Полнотекстовый поиск по выгруженным сообщениям (SQLite FTS5).
+
+Индекс пополняется прямо из потока выгрузки (DiscordExporter(search_index_path=...))
+или из готовых файлов экспорта JSON/JSON Lines, в том числе сжатых и
+нарезанных на части:
+
+    python discord_search.py --db search.db index exports/*.json*
+    python discord_search.py search "релиз OR деплой" --db search.db --channel 123 --from 2024-01-01 --context 2
+
+Повторная индексация того же сообщения обновляет его, а не дублирует.
+"""
+import sys
+import json
+import time
+import sqlite3
+import argparse
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Optional, List, Dict, Any, Union, Iterable
+from discord_models import Message
+from discord_output import read_messages, read_tables, export_files
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    channel_id INTEGER NOT NULL,
+    author_id INTEGER,
+    author TEXT,
+    timestamp TEXT,
+    content TEXT
+);
+CREATE INDEX IF NOT EXISTS messages_channel_id ON messages(channel_id, id);
+CREATE INDEX IF NOT EXISTS messages_author ON messages(author);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    content, author, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts(rowid, content, author) VALUES (new.id, new.content, new.author);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, content, author) VALUES ('delete', old.id, old.content, old.author);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_au AFTER UPDATE ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, content, author) VALUES ('delete', old.id, old.content, old.author);
+    INSERT INTO messages_fts(rowid, content, author) VALUES (new.id, new.content, new.author);
+END;
+"""
+
+# Изменившиеся сообщения обновляются, неизменные не трогают FTS-индекс
+UPSERT = """
+INSERT INTO messages (id, channel_id, author_id, author, timestamp, content) VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT(id) DO UPDATE SET
+    channel_id = excluded.channel_id, author_id = excluded.author_id, author = excluded.author,
+    timestamp = excluded.timestamp, content = excluded.content
+WHERE excluded.content IS NOT messages.content OR excluded.author IS NOT messages.author
+    OR excluded.timestamp IS NOT messages.timestamp
+"""
+
+INDEX_BATCH_SIZE = 1000  # сообщений в одной транзакции при индексации файлов
+
+def _author_name(author: Optional[Dict[str, Any]]) -> Optional[str]:
+    if not author:
+        return None
+    return author.get('global_name') or author.get('username')
+
+def _fts_query(query: str) -> str:
+    """Слова запроса как фразы FTS5: спецсимволы пользователя не ломают синтаксис"""
+    terms = []
+    for term in query.split():
+        if term in ('AND', 'OR', 'NOT'):
+            terms.append(term)
+        else:
+            terms.append('"' + term.replace('"', '""') + '"')
+    return ' '.join(terms)
+
+def _day_start(value: str) -> str:
+    return date.fromisoformat(value).isoformat()
+
+def _day_after(value: str) -> str:
+    return (date.fromisoformat(value) + timedelta(days=1)).isoformat()
+
+class SearchIndex:
+    """Индекс FTS5 по тексту и автору сообщений с фильтрами по каналу и дате"""
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def add_page(self, page: List[Message]):
+        """Индексация страницы из потока выгрузки одной транзакцией"""
+        with self.conn:
+            self.conn.executemany(UPSERT, [
+                (message.id, message.channel_id, message.author.id if message.author else None,
+                 (message.author.global_name or message.author.username) if message.author else None,
+                 message.timestamp, message.content)
+                for message in page
+            ])
+
+    def add_messages(self, messages: Iterable[Dict[str, Any]], channel_id: Optional[int] = None,
+                     authors: Optional[Dict[str, Dict[str, Any]]] = None) -> int:
+        """Индексация словарей сообщений из файлов экспорта; возвращает их число.
+
+        authors - таблица авторов нормализованного экспорта, где в сообщениях
+        только author_id.
+        """
+        count = 0
+        batch = []
+        for message in messages:
+            author = message.get('author')
+            if author is None and authors and message.get('author_id') is not None:
+                author = authors.get(message['author_id'])
+            batch.append((
+                int(message['id']),
+                int(message.get('channel_id') or channel_id),
+                int(author['id']) if author and author.get('id') else None,
+                _author_name(author),
+                message.get('timestamp'),
+                message.get('content') or '',
+            ))
+            if len(batch) >= INDEX_BATCH_SIZE:
+                with self.conn:
+                    self.conn.executemany(UPSERT, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            with self.conn:
+                self.conn.executemany(UPSERT, batch)
+            count += len(batch)
+        return count
+
+    def add_file(self, path: Union[str, Path]) -> int:
+        tables = read_tables(path)
+        return self.add_messages(read_messages(path), authors=tables['authors'] if tables else None)
+
+    def search(self, query: str, channel_id: Optional[int] = None, author: Optional[str] = None,
+               date_from: Optional[str] = None, date_to: Optional[str] = None,
+               limit: int = 20, context: int = 0, raw: bool = False) -> List[Dict[str, Any]]:
+        """Сообщения по запросу, лучшие совпадения первыми.
+
+        query - слова (все должны встретиться, допускаются AND/OR/NOT), raw=True
+        передаёт запрос в MATCH как есть. date_from/date_to - даты YYYY-MM-DD
+        включительно. context - сколько соседних сообщений канала вернуть до и
+        после каждого совпадения.
+        """
+        sql = ("SELECT m.id, m.channel_id, m.author, m.timestamp, m.content, "
+               "snippet(messages_fts, 0, '[', ']', '…', 16) "
+               "FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid WHERE messages_fts MATCH ?")
+        params: List[Any] = [query if raw else _fts_query(query)]
+        if channel_id is not None:
+            sql += ' AND m.channel_id = ?'
+            params.append(channel_id)
+        if author is not None:
+            sql += ' AND m.author = ?'
+            params.append(author)
+        if date_from:
+            sql += ' AND m.timestamp >= ?'
+            params.append(_day_start(date_from))
+        if date_to:
+            sql += ' AND m.timestamp < ?'
+            params.append(_day_after(date_to))
+        sql += ' ORDER BY messages_fts.rank LIMIT ?'
+        params.append(limit)
+
+        results = []
+        for message_id, message_channel_id, message_author, timestamp, content, snippet in self.conn.execute(sql, params):
+            result = {
+                'id': str(message_id), 'channel_id': str(message_channel_id), 'author': message_author,
+                'timestamp': timestamp, 'content': content, 'snippet': snippet,
+            }
+            if context:
+                result['before'] = self._context(message_channel_id, message_id, context, older=True)
+                result['after'] = self._context(message_channel_id, message_id, context, older=False)
+            results.append(result)
+        return results
+
+    def _context(self, channel_id: int, message_id: int, count: int, older: bool) -> List[Dict[str, Any]]:
+        if older:
+            sql = 'SELECT id, author, timestamp, content FROM messages WHERE channel_id = ? AND id < ? ORDER BY id DESC LIMIT ?'
+        else:
+            sql = 'SELECT id, author, timestamp, content FROM messages WHERE channel_id = ? AND id > ? ORDER BY id LIMIT ?'
+        rows = self.conn.execute(sql, (channel_id, message_id, count)).fetchall()
+        if older:
+            rows.reverse()
+        return [{'id': str(row[0]), 'author': row[1], 'timestamp': row[2], 'content': row[3]} for row in rows]
+
+    def count(self) -> int:
+        return self.conn.execute('SELECT COUNT(*) FROM messages').fetchone()[0]
+
+def print_result(result: Dict[str, Any]):
+    for message in result.get('before', []):
+        print(f"    [{message['timestamp']}] {message['author']}: {message['content']}")
+    print(f"  > [{result['timestamp']}] {result['author']} (канал {result['channel_id']}, id {result['id']}): {result['snippet']}")
+    for message in result.get('after', []):
+        print(f"    [{message['timestamp']}] {message['author']}: {message['content']}")
+    print()
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Полнотекстовый поиск по выгруженным сообщениям Discord")
+    parser.add_argument('--db', default='exports/search.db', help="файл индекса SQLite")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    index = commands.add_parser('index', help="добавить файлы экспорта в индекс")
+    index.add_argument('files', nargs='+', help="JSON/JSON Lines (в том числе .gz/.zst) или *.index.json")
+
+    search = commands.add_parser('search', help="найти сообщения")
+    search.add_argument('query')
+    search.add_argument('--channel', type=int, help="ID канала")
+    search.add_argument('--author', help="имя автора")
+    search.add_argument('--from', dest='date_from', help="с даты YYYY-MM-DD")
+    search.add_argument('--to', dest='date_to', help="по дату YYYY-MM-DD включительно")
+    search.add_argument('--limit', type=int, default=20)
+    search.add_argument('--context', type=int, default=0, help="соседних сообщений до и после совпадения")
+    search.add_argument('--raw', action='store_true', help="передать запрос в FTS5 MATCH без обработки")
+    search.add_argument('--json', action='store_true', help="вывести результаты в JSON")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    index = SearchIndex(args.db)
+    try:
+        if args.command == 'index':
+            # Glob по каталогу выгрузки захватывает и служебные файлы - они пропускаются
+            files = export_files(args.files)
+            if len(files) < len(args.files):
+                print(f"Пропущено служебных файлов и частей, уже входящих в индексы: {len(args.files) - len(files)}")
+            failed = 0
+            for path in files:
+                started = time.perf_counter()
+                try:
+                    count = index.add_file(path)
+                except (OSError, ValueError) as e:
+                    failed += 1
+                    print(f"{path}: ошибка: {e}")
+                    continue
+                print(f"{path}: {count} сообщений за {time.perf_counter() - started:.2f} с")
+            print(f"В индексе {index.count()} сообщений")
+            return 1 if failed else 0
+
+        started = time.perf_counter()
+        results = index.search(args.query, args.channel, args.author, args.date_from, args.date_to,
+                               args.limit, args.context, args.raw)
+        elapsed = time.perf_counter() - started
+        if args.json:
+            print(json.dumps(results, ensure_ascii=False, indent=2))
+        else:
+            for result in results:
+                print_result(result)
+            print(f"Найдено {len(results)} за {elapsed * 1000:.1f} мс")
+        return 0
+    finally:
+        index.close()
+
+if __name__ == '__main__':
+    sys.exit(main())
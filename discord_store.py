@@ -0,0 +1,203 @@
+import json
+import sqlite3
+from pathlib import Path
+from typing import Optional, List, Dict, Any, Union, Iterator
+from discord_models import Message, Author, Attachment, Reaction, AuthorCache
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS authors (
+    id INTEGER PRIMARY KEY,
+    username TEXT,
+    global_name TEXT,
+    discriminator TEXT,
+    avatar TEXT,
+    bot INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    channel_id INTEGER NOT NULL,
+    author_id INTEGER REFERENCES authors(id),
+    type INTEGER NOT NULL DEFAULT 0,
+    content TEXT,
+    timestamp TEXT,
+    edited_timestamp TEXT,
+    pinned INTEGER NOT NULL DEFAULT 0,
+    reference_message_id INTEGER,
+    reference_channel_id INTEGER,
+    embeds TEXT,
+    mention_roles TEXT
+);
+CREATE INDEX IF NOT EXISTS messages_channel_id ON messages(channel_id, id);
+CREATE TABLE IF NOT EXISTS attachments (
+    id INTEGER PRIMARY KEY,
+    message_id INTEGER NOT NULL REFERENCES messages(id),
+    filename TEXT,
+    url TEXT,
+    proxy_url TEXT,
+    size INTEGER,
+    content_type TEXT,
+    local_path TEXT
+);
+CREATE INDEX IF NOT EXISTS attachments_message_id ON attachments(message_id);
+CREATE TABLE IF NOT EXISTS mentions (
+    message_id INTEGER NOT NULL REFERENCES messages(id),
+    author_id INTEGER NOT NULL REFERENCES authors(id)
+);
+CREATE INDEX IF NOT EXISTS mentions_message_id ON mentions(message_id);
+CREATE TABLE IF NOT EXISTS reactions (
+    message_id INTEGER NOT NULL REFERENCES messages(id),
+    emoji_id INTEGER,
+    emoji_name TEXT,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (message_id, emoji_id, emoji_name)
+);
+"""
+# Колонки, добавленные после первой версии схемы: в старые базы добавляются через ALTER TABLE
+ADDED_COLUMNS = {
+    'messages': {'mention_roles': 'TEXT'},
+    'attachments': {'local_path': 'TEXT'},
+}
+
+class MessageStore:
+    """Локальное хранилище сообщений в SQLite.
+
+    Страницы из API записываются одной транзакцией на страницу; повторная
+    запись того же сообщения заменяет его (например, после редактирования).
+    Из хранилища можно отрендерить любой формат экспорта без сети.
+    """
+
+    PAGE_SIZE = 100
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.authors = AuthorCache()
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+        self._add_columns()
+
+    def _add_columns(self):
+        for table, columns in ADDED_COLUMNS.items():
+            existing = {row[1] for row in self.conn.execute(f'PRAGMA table_info({table})')}
+            for column, column_type in columns.items():
+                if column not in existing:
+                    self.conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+
+    def close(self):
+        self.conn.close()
+
+    def add_page(self, page: List[Message]):
+        """Запись страницы сообщений в одной транзакции"""
+        authors = {}
+        messages = []
+        attachments = []
+        reactions = []
+        mentions = []
+        message_ids = []
+        # Пути загруженных копий сохраняются, даже если эта выгрузка шла без загрузки вложений
+        local_paths = dict(self.conn.execute(
+            f'SELECT id, local_path FROM attachments WHERE local_path IS NOT NULL AND message_id IN ({",".join("?" * len(page))})',
+            [message.id for message in page]))
+        for message in page:
+            for author in (message.author, *message.mentions):
+                if author is not None:
+                    authors[author.id] = (author.id, author.username, author.global_name,
+                                          author.discriminator, author.avatar, int(author.bot))
+            author = message.author
+            message_ids.append((message.id,))
+            messages.append((
+                message.id, message.channel_id, author.id if author else None, message.type, message.content,
+                message.timestamp, message.edited_timestamp, int(message.pinned),
+                message.reference_message_id, message.reference_channel_id,
+                json.dumps(message.embeds, ensure_ascii=False) if message.embeds else None,
+                json.dumps(message.mention_roles) if message.mention_roles else None,
+            ))
+            for attachment in message.attachments:
+                attachments.append((
+                    attachment.id, message.id, attachment.filename, attachment.url,
+                    attachment.proxy_url, attachment.size, attachment.content_type,
+                    attachment.local_path or local_paths.get(attachment.id),
+                ))
+            mentions.extend((message.id, author.id) for author in message.mentions)
+            for reaction in message.reactions:
+                reactions.append((message.id, reaction.emoji_id, reaction.emoji_name, reaction.count))
+
+        with self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO authors VALUES (?, ?, ?, ?, ?, ?)', authors.values())
+            # Вложения, реакции и упоминания переписываем целиком: у изменённого сообщения они могли пропасть
+            self.conn.executemany('DELETE FROM attachments WHERE message_id = ?', message_ids)
+            self.conn.executemany('DELETE FROM reactions WHERE message_id = ?', message_ids)
+            self.conn.executemany('DELETE FROM mentions WHERE message_id = ?', message_ids)
+            self.conn.executemany('INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', messages)
+            self.conn.executemany('INSERT OR REPLACE INTO attachments VALUES (?, ?, ?, ?, ?, ?, ?, ?)', attachments)
+            self.conn.executemany('INSERT OR REPLACE INTO reactions VALUES (?, ?, ?, ?)', reactions)
+            self.conn.executemany('INSERT INTO mentions VALUES (?, ?)', mentions)
+
+    def channel_ids(self) -> List[int]:
+        return [row[0] for row in self.conn.execute('SELECT DISTINCT channel_id FROM messages ORDER BY channel_id')]
+
+    def iter_pages(self, channel_id: int, before: Optional[int] = None, after: Optional[int] = None) -> Iterator[List[Message]]:
+        """Страницы сообщений канала от новых к старым, как их отдаёт API"""
+        cursor = before
+        while True:
+            query = 'SELECT * FROM messages WHERE channel_id = ?'
+            params: List[Any] = [channel_id]
+            if cursor is not None:
+                query += ' AND id < ?'
+                params.append(int(cursor))
+            if after is not None:
+                query += ' AND id > ?'
+                params.append(int(after))
+            query += ' ORDER BY id DESC LIMIT ?'
+            params.append(self.PAGE_SIZE)
+            rows = self.conn.execute(query, params).fetchall()
+            if not rows:
+                return
+            yield self._build_messages(rows)
+            cursor = rows[-1][0]
+
+    def _build_messages(self, rows: List[tuple]) -> List[Message]:
+        """Восстановление сообщений из строк таблиц"""
+        ids = [row[0] for row in rows]
+        placeholders = ','.join('?' * len(ids))
+        mention_ids: Dict[int, List[int]] = {}
+        for message_id, author_id in self.conn.execute(
+                f'SELECT message_id, author_id FROM mentions WHERE message_id IN ({placeholders}) ORDER BY rowid', ids):
+            mention_ids.setdefault(message_id, []).append(author_id)
+        author_ids = list({row[2] for row in rows if row[2] is not None}
+                          | {author_id for users in mention_ids.values() for author_id in users})
+        authors = {}
+        if author_ids:
+            for author_id, username, global_name, discriminator, avatar, bot in self.conn.execute(
+                    f'SELECT * FROM authors WHERE id IN ({",".join("?" * len(author_ids))})', author_ids):
+                authors[author_id] = self.authors.get({
+                    'id': author_id, 'username': username, 'global_name': global_name,
+                    'discriminator': discriminator, 'avatar': avatar, 'bot': bool(bot),
+                })
+        attachments: Dict[int, List[Attachment]] = {}
+        for attachment_id, message_id, filename, url, proxy_url, size, content_type, local_path in self.conn.execute(
+                f'SELECT * FROM attachments WHERE message_id IN ({placeholders}) ORDER BY id', ids):
+            attachments.setdefault(message_id, []).append(
+                Attachment(attachment_id, filename, url, proxy_url, size, content_type, local_path))
+        reactions: Dict[int, List[Reaction]] = {}
+        for message_id, emoji_id, emoji_name, count in self.conn.execute(
+                f'SELECT * FROM reactions WHERE message_id IN ({placeholders}) ORDER BY rowid', ids):
+            reactions.setdefault(message_id, []).append(Reaction(emoji_id, emoji_name, count))
+
+        return [
+            Message(
+                message_id, channel_id, message_type,
+                authors.get(author_id) or (Author(author_id, None) if author_id is not None else None),
+                content or '', timestamp, edited_timestamp, bool(pinned),
+                tuple(attachments.get(message_id, ())),
+                tuple(json.loads(embeds)) if embeds else (),
+                tuple(reactions.get(message_id, ())),
+                mentions=tuple(authors.get(user_id) or Author(user_id, None) for user_id in mention_ids.get(message_id, ())),
+                mention_roles=tuple(json.loads(mention_roles)) if mention_roles else (),
+                reference_message_id=reference_message_id,
+                reference_channel_id=reference_channel_id,
+            )
+            for (message_id, channel_id, author_id, message_type, content, timestamp, edited_timestamp,
+                 pinned, reference_message_id, reference_channel_id, embeds, mention_roles) in rows
+        ]
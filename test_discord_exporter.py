@@ -0,0 +1,283 @@
+"""Регрессионные тесты экспортера на локальном имитаторе Discord API.
+
+    python -m pytest -q
+"""
+import sys
+import asyncio
+import tempfile
+import unittest
+import subprocess
+from unittest import mock
+from aiohttp import web
+from pathlib import Path
+from discord_benchmark import MockDiscordAPI
+from datetime import datetime, timezone
+from discord_exporter import (DiscordExporter, ExportManifest, export_channels, datetime_to_snowflake,
+                              parse_date_snowflake)
+import discord_jobs
+from discord_jobs import JobQueue, JobRunner, add_specs, validate_job, yaml
+from discord_models import Message, AuthorCache
+from discord_store import MessageStore
+import discord_search
+import discord_merge
+from discord_output import read_messages
+
+class ExporterTestCase(unittest.IsolatedAsyncioTestCase):
+    CHANNELS = {1000: 250, 2000: 120}  # канал -> число сообщений в имитаторе
+
+    async def asyncSetUp(self):
+        self.api = MockDiscordAPI(dict(self.CHANNELS))
+        self.api_base = await self.api.start()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.output_dir = Path(self.tmp.name)
+
+    async def asyncTearDown(self):
+        await self.api.stop()
+        self.tmp.cleanup()
+
+    def exporter(self, **options) -> DiscordExporter:
+        options.setdefault('output_dir', str(self.output_dir))
+        options.setdefault('token', 'test')
+        return DiscordExporter(api_base=self.api_base, quiet=True, **options)
+
+    async def export(self, channel_id: int, **options):
+        async with self.exporter(**options) as exporter:
+            return await exporter.export_channel(channel_id), exporter.exported_files
+
+class ManifestTest(ExporterTestCase):
+    async def test_rerun_without_new_messages_is_skipped(self):
+        self.assertEqual((await self.export(1000))[0], 250)
+        self.assertEqual(await self.export(1000), (0, []))
+
+    async def test_other_format_is_exported_in_full(self):
+        await self.export(1000, output_format='json')
+        count, files = await self.export(1000, output_format='csv')
+        self.assertEqual(count, 250)
+        self.assertEqual([path.suffix for path in files], ['.csv'])
+
+    async def test_other_compression_is_exported_in_full(self):
+        await self.export(1000)
+        count, files = await self.export(1000, compression='gzip')
+        self.assertEqual(count, 250)
+        self.assertEqual(len(list(read_messages(files[0]))), 250)
+
+    async def test_deleted_output_is_exported_again(self):
+        _, files = await self.export(1000)
+        for path in files:
+            path.unlink()
+        count, files = await self.export(1000)
+        self.assertEqual(count, 250)
+        messages = [int(message['id']) for message in read_messages(files[0])]
+        self.assertEqual(messages, sorted(set(messages), reverse=True))
+        self.assertEqual(len(messages), 250)
+
+    async def test_deleted_shard_range_is_refetched(self):
+        _, old_files = await self.export(1000)
+        self.api.channel_sizes[1000] = 300
+        self.assertEqual((await self.export(1000))[0], 50)
+        for path in old_files:
+            path.unlink()
+        count, files = await self.export(1000)
+        self.assertEqual(count, 250)
+        messages = [int(message['id']) for message in read_messages(files[0])]
+        self.assertEqual(messages, [int(self.api.message(1000, i)['id']) for i in range(249, -1, -1)])
+
+class SlicedFetchTest(ExporterTestCase):
+    async def test_message_on_slice_bound_is_fetched(self):
+        before, after = (int(self.api.message(1000, i)['id']) for i in (10, 0))
+        async with self.exporter() as exporter:
+            sequential = [message['id'] async for page in exporter._fetch_message_pages(1000, None, before, after)
+                          for message in page]
+            sliced = [message['id'] async for page in exporter._fetch_message_pages_sliced(1000, 2, before, after)
+                      for message in page]
+        self.assertEqual(len(sequential), 9)
+        self.assertEqual(sliced, sequential)
+
+    async def test_thread_opening_post_is_fetched(self):
+        # Первое сообщение ветки имеет тот же ID, что и сама ветка
+        thread_id = int(self.api.message(0, 0)['id'])
+        self.api.channel_sizes[thread_id] = 50
+        async with self.exporter() as exporter:
+            sliced = [message['id'] async for page in exporter._fetch_message_pages_sliced(thread_id, 4)
+                      for message in page]
+        self.assertEqual(len(sliced), 50)
+        self.assertEqual(sliced[-1], str(thread_id))
+
+    def test_date_range_includes_midnight_message(self):
+        midnight = datetime_to_snowflake(datetime(2024, 1, 1, tzinfo=timezone.utc))
+        self.assertLess(parse_date_snowflake('2024-01-01'), midnight)
+        self.assertGreater(parse_date_snowflake('2023-12-31', end_of_day=True), midnight - 1)
+
+class TextRateLimitAPI(MockDiscordAPI):
+    """Имитатор, у которого каждая третья страница истории сначала отвечает 429 текстом, как Cloudflare"""
+
+    async def messages(self, request: web.Request) -> web.Response:
+        self.pages = getattr(self, 'pages', 0) + 1
+        if self.pages % 3 == 0:
+            self.rate_limited += 1
+            return web.Response(status=429, text='error code: 1015', headers={'Retry-After': '0.05'})
+        return await super().messages(request)
+
+class RateLimitTest(ExporterTestCase):
+    async def test_text_429_is_retried(self):
+        await self.api.stop()
+        self.api = TextRateLimitAPI(dict(self.CHANNELS))
+        self.api_base = await self.api.start()
+        count, files = await self.export(1000)
+        self.assertEqual(count, 250)
+        self.assertEqual(self.api.rate_limited, 1)
+        self.assertEqual(len(list(read_messages(files[0]))), 250)
+
+class MetadataCacheTest(ExporterTestCase):
+    async def test_cache_is_dropped_when_token_changes(self):
+        for token, requests in (('first', 1), ('first', 1), ('second', 2)):
+            async with self.exporter(token=token) as exporter:
+                await exporter.get_user_info()
+            self.assertEqual(self.api.requests, requests)
+
+    async def test_guild_export_sees_first_message_of_cached_channel(self):
+        self.api.channel_sizes[3000] = 0
+        async with self.exporter() as exporter:
+            exporter._ask_export_params = lambda: (None, None, None)
+            await exporter.export_guild(100)
+        self.api.channel_sizes[3000] = 30
+        async with self.exporter() as exporter:
+            exporter._ask_export_params = lambda: (None, None, None)
+            requests = self.api.requests
+            await exporter.export_guild(100)
+            self.assertEqual([path.name.split('_')[1] for path in exporter.exported_files], ['3000'])
+            # Список каналов взят из кэша: запросы только к истории трёх каналов
+            self.assertEqual(exporter.metadata.hits, 1)
+            self.assertEqual(self.api.requests - requests, 3)
+
+class ExportChannelsTest(ExporterTestCase):
+    async def test_unknown_channel_maps_to_none(self):
+        counts = await export_channels([1000, 999], token='test', api_base=self.api_base,
+                                       output_dir=str(self.output_dir), quiet=True)
+        self.assertEqual(counts, {1000: 250, 999: None})
+
+class ImportTest(unittest.TestCase):
+    def test_optional_dependencies_load_lazily(self):
+        heavy = ('aiohttp', 'jinja2', 'orjson', 'sqlite3', 'gzip', 'zstandard', 'pyarrow')
+        code = f"import sys, discord_exporter; print(','.join(m for m in {heavy!r} if m in sys.modules))"
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                                cwd=Path(__file__).parent)
+        self.assertEqual(result.stdout.strip(), '')
+
+class SearchIndexTest(ExporterTestCase):
+    async def test_index_glob_over_output_dir(self):
+        await self.export(1000, output_format='json,jsonl,html', normalized=True, shard_messages=100, html_page_size=100)
+        await self.export(1000, output_format='jsonl', compression='gzip')
+        db = self.output_dir / 'search.db'
+        files = sorted(map(str, self.output_dir.glob('*.json*')))
+        self.assertEqual(discord_search.main(['--db', str(db), 'index', *files]), 0)
+        index = discord_search.SearchIndex(db)
+        try:
+            self.assertEqual(index.count(), 250)
+        finally:
+            index.close()
+
+    async def test_missing_file_is_reported_and_skipped(self):
+        await self.export(2000)
+        files = [str(self.output_dir / 'channel_2000_missing.json.index.json'), *map(str, self.output_dir.glob('*.json'))]
+        self.assertEqual(discord_search.main(['--db', str(self.output_dir / 'search.db'), 'index', *files]), 1)
+
+class MergeTest(ExporterTestCase):
+    async def test_merge_glob_over_channel_files(self):
+        await self.export(1000, output_format='json,jsonl,html', normalized=True, shard_messages=100, html_page_size=100)
+        self.api.channel_sizes[1000] = 300
+        await self.export(1000, output_format='json,jsonl,html', normalized=True, shard_messages=100, html_page_size=100,
+                          incremental=False)
+        merged_dir = self.output_dir / 'merged'
+        files = sorted(map(str, self.output_dir.glob('channel_1000_*')))
+        self.assertEqual(await discord_merge.run([*files, '--format', 'jsonl', '--output-dir', str(merged_dir)]), 0)
+        merged, = merged_dir.glob('*.jsonl')
+        messages = [int(message['id']) for message in read_messages(merged)]
+        self.assertEqual(messages, [int(self.api.message(1000, i)['id']) for i in range(299, -1, -1)])
+
+class StoreTest(unittest.TestCase):
+    def test_offline_export_needs_no_token(self):
+        async def export(tmp: Path):
+            async with DiscordExporter(token=None, output_dir=str(tmp), store_path=str(tmp / 'store.db'),
+                                       quiet=True) as exporter:
+                exporter.store.add_page([Message.from_api({'id': '50', 'channel_id': '1', 'content': 'hi'}, AuthorCache())])
+                return await exporter.export_from_store(1)
+
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.dict('os.environ', clear=True):
+            self.assertEqual(asyncio.run(export(Path(tmp))), 1)
+
+    def test_round_trip_keeps_mentions_and_local_paths(self):
+        message = Message.from_api({
+            'id': '50', 'channel_id': '1', 'content': 'hi <@8>', 'timestamp': '2024-01-01T00:00:00+00:00',
+            'author': {'id': '2', 'username': 'author'}, 'mentions': [{'id': '8', 'username': 'mentioned'}],
+            'mention_roles': ['7'], 'attachments': [{'id': '9', 'filename': 'a.png', 'url': 'https://cdn/a.png'}],
+        }, AuthorCache())
+        message.attachments[0].local_path = 'attachments/files/9-a.png'
+        with tempfile.TemporaryDirectory() as tmp:
+            store = MessageStore(Path(tmp) / 'store.db')
+            try:
+                store.add_page([message])
+                stored, = next(store.iter_pages(1))
+            finally:
+                store.close()
+        self.assertEqual(stored.to_dict(), message.to_dict())
+        self.assertEqual(stored.export_dict(normalized=True), message.export_dict(normalized=True))
+
+class JobSpecTest(unittest.TestCase):
+    @unittest.skipIf(yaml is None, "PyYAML is not installed")
+    def test_unquoted_yaml_dates_are_accepted(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            spec = Path(tmp) / 'jobs.yaml'
+            spec.write_text('jobs:\n  - channel: 1000\n    from: 2024-01-01\n', encoding='utf-8')
+            queue = JobQueue(Path(tmp) / 'jobs.db')
+            try:
+                self.assertEqual(add_specs(queue, [str(spec)]), 1)
+                self.assertEqual(queue.jobs()[0]['spec'], {'channel': 1000, 'from': '2024-01-01'})
+            finally:
+                queue.close()
+
+    def test_non_string_date_is_rejected(self):
+        with self.assertRaises(ValueError):
+            validate_job({'channel': 1000, 'to': 20240101})
+
+    def test_cli_adds_all_jobs_or_none(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            db = str(Path(tmp) / 'jobs.db')
+            spec = Path(tmp) / 'jobs.json'
+            spec.write_text('[{"channel": 1000}, {"channel": 2000, "format": "docx"}]', encoding='utf-8')
+            with mock.patch('builtins.print'):
+                self.assertEqual(discord_jobs.main(['--db', db, 'add', str(spec), '--channel', '3000']), 2)
+                self.assertEqual(discord_jobs.main(['--db', db, 'add', '--channel', '1000', '--channel', '2000',
+                                                    '--guild', '100', '--from', '2024-01-01']), 0)
+            queue = JobQueue(db)
+            try:
+                self.assertEqual([job['spec'] for job in queue.jobs()], [
+                    {'channel': 1000, 'from': '2024-01-01'}, {'channel': 2000, 'from': '2024-01-01'},
+                    {'guild': 100, 'from': '2024-01-01'}])
+            finally:
+                queue.close()
+
+    def test_zstd_without_zstandard_is_rejected(self):
+        with mock.patch.dict('sys.modules', {'zstandard': None}), tempfile.TemporaryDirectory() as tmp:
+            with self.assertRaises(ValueError):
+                validate_job({'channel': 1000, 'compression': 'zstd'})
+            with self.assertRaises(ValueError):
+                DiscordExporter(output_dir=tmp, compression='zstd')
+
+class JobRunnerTest(ExporterTestCase):
+    async def test_exporters_share_manifest_of_output_dir(self):
+        queue = JobQueue(self.output_dir / 'jobs.db')
+        try:
+            queue.add({'channel': 1000, 'format': 'json', 'output_dir': str(self.output_dir)})
+            queue.add({'channel': 2000, 'format': 'csv', 'output_dir': str(self.output_dir)})
+            runner = JobRunner(queue, concurrency=2, progress_interval=60,
+                               exporter_options={'token': 'test', 'api_base': self.api_base})
+            self.assertEqual(await runner.run(), {'done': 2, 'failed': 0})
+        finally:
+            queue.close()
+        manifest = ExportManifest(self.output_dir)
+        self.assertEqual(manifest.channel(1000, 'json')['gaps'], [])
+        self.assertEqual(manifest.channel(2000, 'csv')['gaps'], [])
+
+if __name__ == '__main__':
+    unittest.main()